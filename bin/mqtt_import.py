@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MQTT_IMPORT: importa nel database i messaggi salvati su file
+
+Lo script legge file con messaggi catturati (dump del broker, log dei nodi,
+file di spool di altre installazioni) e li inserisce nel database senza
+passare dal broker MQTT.
+
+I file vengono letti riga per riga da una catena di generatori
+(memoria costante anche con file molto grandi):
+
+- :func:`read_lines()`: legge le righe dei file
+- :func:`parse_records()`: riconosce il formato della riga e restituisce topic, messaggio e timestamp
+- :func:`import_records()`: valida il MAC con :func:`mqtt_manager.valid_mac()` e inserisce i dati
+  con :func:`mqtt_manager.insert_data()` (stessa gestione dei tipi di nodo di mqtt_manager)
+
+Formati riconosciuti (una riga per messaggio):
+
+- spool di mqtt_manager: ``{"mac": "<mac>", "tstamp": <timestamp>, "msg": {...}}``
+- JSON con topic: ``{"topic": "data/<mac>", "payload": {...}, "tstamp": <timestamp>}``
+- output di mosquitto_sub -v: ``data/<mac> {...}``, eventualmente preceduto dal timestamp
+  (ex. ``mosquitto_sub -v -F "%U %t %p"``)
+
+Utilizzo::
+
+   python3 mqtt_import.py [--config config.ini] [--batch 5000] file1 file2 ...
+
+Di default le righe per ogni INSERT sono ``batch_size`` della sezione 'Performance'
+della configurazione.
+
+"""
+__author__ = "Zenaro Stefano"
+__version__ = "01_01 2020-02-23"
+
+import argparse
+import json
+import re
+import sys
+import time
+
+import mqtt_manager
+
+
+class BulkStorage:
+    """
+    Database che accumula i dati e li inserisce a blocchi.
+
+    Sostituisce :data:`mqtt_manager.storage` durante l'importazione:
+    i dati inseriti da :meth:`add_type0_data()` vengono accumulati,
+    validati tutti insieme con :func:`mqtt_manager.validate_type0()`
+    e inseriti nel database <t_storage> con un'unica INSERT da <t_batch> righe,
+    tutti gli altri metodi vengono passati a <t_storage>.
+    Un blocco rifiutato dal database non interrompe l'importazione (vedi :meth:`flush()`).
+    A ogni blocco inserito visualizza l'avanzamento (righe inserite e righe al secondo).
+
+    :param t_storage: oggetto database (MySQLStorage o SQLiteStorage)
+    :param int t_batch: numero di righe per INSERT
+    """
+
+    def __init__(self, t_storage, t_batch):
+        self.storage = t_storage
+        self.batch = t_batch
+        self.rows = []
+        self.count = 0  # righe inserite nel database
+        self.rejected = 0  # righe scartate dalla validazione
+        self.failed = 0  # righe rifiutate dal database
+        self.start = time.time()
+
+    def __getattr__(self, t_name):
+        return getattr(self.storage, t_name)
+
+    def add_type0_data(self, t_rows, t_validate=True):
+        """
+        Accumula i dati dei nodi di tipo 0 e li inserisce a blocchi di <batch> righe.
+
+        :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+        :param bool t_validate: ignorato, tutte le righe vengono validate da :meth:`flush()`
+        """
+        self.rows.extend(t_rows)
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserisce le righe accumulate e conferma le modifiche.
+
+        Se il database rifiuta il blocco (ex. un valore non valido in una riga) le modifiche
+        vengono annullate e le righe inserite una alla volta con :meth:`insert_rows()`.
+        Gli errori di connessione (:data:`mqtt_manager.storage_unavailable_errors`)
+        vengono propagati al chiamante e interrompono l'importazione.
+        """
+        if self.rows:
+            rows = mqtt_manager.validate_type0(self.rows)
+            self.rejected += len(self.rows) - len(rows)
+            self.rows = []
+
+            if rows:
+                try:
+                    self.storage.add_type0_data(rows)
+
+                except mqtt_manager.storage_unavailable_errors:
+                    raise
+
+                except mqtt_manager.storage_errors as t_e:
+                    mqtt_manager.logger("WARNING: blocco di {} righe rifiutato dal database, inserimento una riga "
+                                        "alla volta: '{}'".format(len(rows), t_e), mqtt_manager.logfile)
+                    self.storage.rollback()
+                    rows = self.insert_rows(rows)
+
+            self.count += len(rows)
+        self.storage.commit()
+
+        print("{} righe inserite ({:.0f} righe/s)".format(self.count, self.rate()))
+
+    def insert_rows(self, t_rows):
+        """
+        Inserisce le righe <t_rows> una alla volta.
+
+        Le righe rifiutate dal database vengono scritte nel log e contate in <failed>.
+
+        :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+        :return rows: lista delle tuple inserite
+        :rtype: list
+        """
+        rows = []
+
+        for row in t_rows:
+            try:
+                self.storage.add_type0_data([row])
+                rows.append(row)
+
+            except mqtt_manager.storage_unavailable_errors:
+                raise
+
+            except mqtt_manager.storage_errors as t_e:
+                self.failed += 1
+                mqtt_manager.logger("WARNING: riga {} rifiutata dal database: '{}'".format(row, t_e),
+                                    mqtt_manager.logfile)
+
+        return rows
+
+    def rate(self):
+        """
+        Restituisce le righe inserite al secondo dall'inizio dell'importazione.
+
+        :return rate: righe al secondo
+        :rtype: float
+        """
+        return self.count / max(time.time() - self.start, 0.001)
+
+
+def cached_get_node(t_function):
+    """
+    Restituisce la funzione <t_function> (get_node()) con i risultati in memoria.
+
+    Durante l'importazione i nodi non cambiano: ogni nodo
+    viene cercato nel database una sola volta.
+
+    :param t_function: funzione get_node() originale
+    :return get_node: funzione con i risultati in memoria
+    """
+    nodes = {}
+
+    def get_node(t_macaddr):
+        if t_macaddr not in nodes:
+            nodes[t_macaddr] = t_function(t_macaddr)
+        return nodes[t_macaddr]
+
+    return get_node
+
+
+def read_lines(t_paths):
+    """
+    Restituisce una alla volta le righe non vuote dei file <t_paths>.
+
+    Il percorso "-" indica lo standard input.
+
+    :param list t_paths: lista dei percorsi dei file
+    :return line: generatore di righe
+    """
+    for path in t_paths:
+        if path == "-":
+            input_file = sys.stdin
+        else:
+            input_file = open(path, encoding="utf-8", errors="replace")
+
+        try:
+            for line in input_file:
+                line = line.strip()
+                if line:
+                    yield line
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+
+def parse_records(t_lines, t_stats):
+    """
+    Converte le righe in tuple (topic, messaggio, timestamp).
+
+    Le righe in un formato non riconosciuto o con un timestamp non valido vengono scartate e contate in <t_stats>,
+    ai messaggi senza timestamp viene assegnato il timestamp attuale.
+
+    :param t_lines: generatore di righe
+    :param dict t_stats: contatori dell'importazione
+    :return record: generatore di tuple (topic, messaggio, timestamp)
+    """
+    for line in t_lines:
+        t_stats["lines"] += 1
+
+        try:
+            if line.startswith("{"):
+                record = json.loads(line)
+
+                if "mac" in record:
+                    # file di spool di mqtt_manager
+                    topic = "data/" + record["mac"]
+                    message = record["msg"]
+                else:
+                    # JSON con topic e payload
+                    topic = record["topic"]
+                    message = record["payload"]
+                    if isinstance(message, str):
+                        message = json.loads(message)
+
+                timestamp = record.get("tstamp")
+            else:
+                # output di mosquitto_sub -v: [timestamp] <topic> <payload>
+                # (con -F "%U" il timestamp ha la parte decimale, ex. 1470818943.786368637)
+                fields = line.split(" ", 2)
+                if len(fields) == 3 and re.match(r"^[0-9]+(\.[0-9]*)?$", fields[0]):
+                    timestamp = float(fields[0])
+                    topic, payload = fields[1], fields[2]
+                else:
+                    timestamp = None
+                    topic, payload = line.split(" ", 1)
+                message = json.loads(payload)
+
+            if not isinstance(message, dict):
+                raise ValueError("il messaggio non e' un oggetto JSON")
+
+            # ex. "tstamp": "2020-01-01 10:00" non e' un timestamp valido
+            timestamp = int(timestamp) if timestamp is not None else int(time.time())
+
+        except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as t_e:
+            t_stats["invalid"] += 1
+            mqtt_manager.logger("WARNING: riga {} non valida: {}".format(t_stats["lines"], t_e),
+                                mqtt_manager.logfile)
+            continue
+
+        yield topic, message, timestamp
+
+
+def import_records(t_records, t_stats):
+    """
+    Valida i messaggi e li inserisce nel database.
+
+    Come :func:`mqtt_manager.on_message()` il topic deve essere nel formato
+    ``data/<macaddress>`` con un indirizzo MAC valido (:func:`mqtt_manager.valid_mac()`),
+    i dati vengono poi inseriti con :func:`mqtt_manager.insert_data()`.
+
+    :param t_records: generatore di tuple (topic, messaggio, timestamp)
+    :param dict t_stats: contatori dell'importazione
+    """
+    for topic, message, timestamp in t_records:
+        topic_split = topic.split("/")
+
+        if len(topic_split) != 2 or topic_split[0] != "data" or not mqtt_manager.valid_mac(topic_split[1]):
+            t_stats["skipped"] += 1
+            continue
+
+        mqtt_manager.insert_data(topic_split[1], message, timestamp)
+
+
+def main():
+    """
+    Importa nel database i file passati come argomenti.
+
+    A ogni blocco inserito visualizza l'avanzamento, al termine
+    righe lette, scartate, rifiutate dal database, inserite nel database e righe al secondo.
+    """
+    parser = argparse.ArgumentParser(description="Importa nel database i messaggi MQTT salvati su file")
+    parser.add_argument("files", nargs="+", help="file da importare (- per lo standard input)")
+    parser.add_argument("--config", default=mqtt_manager.configfile_path, help="file di configurazione")
+    parser.add_argument("--batch", type=int, help="righe per ogni INSERT (default batch_size della configurazione)")
+    parser.add_argument("--log", default="import_log.txt", help="file di log")
+    args = parser.parse_args()
+
+    mqtt_manager.logfile = open(args.log, "a")
+    stats = {"lines": 0, "invalid": 0, "skipped": 0}
+    bulk = None
+    start = time.time()
+
+    try:
+        # leggi le impostazioni (la sezione 'MQTT broker' non e' necessaria)
+        mqtt_manager.settings = mqtt_manager.Settings.load(args.config, ())
+        mqtt_manager.settings_apply()
+
+        # connettiti al database e accumula le insert
+        bulk = BulkStorage(mqtt_manager.storage_conn(mqtt_manager.settings),
+                           args.batch or mqtt_manager.settings.batch_size)
+        mqtt_manager.storage = bulk
+        mqtt_manager.get_node = cached_get_node(mqtt_manager.get_node)
+
+        # i dati vengono validati a blocchi da BulkStorage e non uno alla volta
+        mqtt_manager.add_type0_data = bulk.add_type0_data
+
+        import_records(parse_records(read_lines(args.files), stats), stats)
+        bulk.flush()
+
+    except mqtt_manager.storage_errors as e:
+        mqtt_manager.logger("ERROR: errore database sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno, e),
+                            mqtt_manager.logfile)
+        print("Errore del database: {}".format(e))
+
+    finally:
+        if bulk is not None:
+            bulk.storage.close()
+        mqtt_manager.logfile.close()
+
+    if bulk is not None:
+        print("Importazione terminata in {:.1f} s: {} righe lette, {} non valide, {} scartate, "
+              "{} in quarantena, {} rifiutate dal database, {} inserite ({:.0f} righe/s)".format(
+                  time.time() - start, stats["lines"], stats["invalid"], stats["skipped"],
+                  bulk.rejected, bulk.failed, bulk.count, bulk.rate()))
+
+
+if __name__ == "__main__":
+    main()
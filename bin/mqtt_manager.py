@@ -19,7 +19,7 @@ __author__ = "Zenaro Stefano"
 __version__ = "01_01 2020-02-23"
 
 import paho.mqtt.client as mqtt
-import mysql.connector
+import sqlite3
 import json
 import time
 import re
@@ -27,11 +27,303 @@ import sys
 import ipaddress
 import os
 import configparser
+import signal
+import random
+import collections
+import functools
+import cProfile
+import tracemalloc
+import calendar
+import pickle
+import threading
+import queue
+
+try:
+    import mysql.connector
+except ImportError:  # necessario solo con il backend MySQL
+    mysql = None
+
+try:
+    import numpy as np
+except ImportError:  # necessario solo con la validazione dei dati
+    np = None
+
+storage = None  # oggetto database (MySQLStorage, SQLiteStorage o OfflineStorage)
+storage_queue = queue.Queue(maxsize=1)  # database connesso o errore di connessione da storage_reconnect()
+client = None  # oggetto client MQTT
+
+configfile_path = os.environ.get("MQTT_MANAGER_CONFIG", "config.ini")
+reload_requested = False  # True = SIGHUP ricevuto, impostazioni da rileggere in mqtt_loop()
+spool_path = "spool.jsonl"  # file dove vengono salvati i dati quando il DB non e' raggiungibile
+
+log_repeated = {}        # messaggi scritti nell'intervallo attuale: chiave -> ripetizioni soppresse
+log_interval_start = 0   # timestamp di inizio dell'intervallo attuale
+
+validation_config = None  # impostazioni della validazione dei dati (None = validazione disattivata)
+validation_history = {}   # ultime letture di ogni nodo: node_id -> deque di (tstamp, temp, hum)
+validation_outliers = {}  # letture consecutive scartate dallo z-score: node_id -> lista di (tstamp, temp, hum)
+validation_stats = {"valid": 0, "nan": 0, "range": 0, "rate": 0, "zscore": 0}  # letture per esito
+validation_reasons = ["valid", "nan", "range", "rate", "zscore"]  # esiti in ordine di codice
+validation_logged = dict.fromkeys(validation_reasons, 0)  # <validation_stats> all'ultimo riepilogo nel log
+quarantine_path = "quarantine.jsonl"  # file dove vengono salvate le letture scartate
+validated_rows = None     # letture accettate dall'ultima validazione di manage_data() (None = non validate)
+
+node_cache = {}            # nodi: mac -> (timestamp caricamento, risultato di get_node())
+type_cache = {}            # tipi di nodo: type_id -> (timestamp caricamento, risultato di get_type())
+options_cache = {}         # ultime impostazioni dei nodi: node_id -> (timestamp caricamento, stringa JSON)
+snapshot_path = "snapshot.bin"  # file con la copia di nodi, tipi e impostazioni
+snapshot_version = 1       # versione del formato dello snapshot
+snapshot_dirty = False     # True = informazioni in memoria modificate dall'ultimo snapshot
+
+reconnect_delay = 1  # attesa massima attuale prima del prossimo tentativo di riconnessione
+
+# ultimi messaggi ricevuti (topic, payload), per riconoscere quelli reinviati dal broker
+recent_messages = collections.deque(maxlen=1000)
+
+profiling = None  # sessione di profiling attiva (None = profiling disattivato)
+profiling_requested = False  # True = SIGUSR1 ricevuto, profiling da avviare o terminare in mqtt_loop()
+profiling_expired = False    # True = SIGALRM ricevuto, profiling da terminare in mqtt_loop()
+
+# funzioni sostituite durante il profiling con la versione che misura i tempi
+profiling_functions = ["on_message", "manage_data", "insert_data", "manage_data_type0", "add_type0_data",
+                       "validate_type0", "manage_presentation",
+                       "present_newnode", "present_oldnode", "add_newnode_options", "add_newnode_options_type0",
+                       "get_options", "get_options_type0", "get_node", "get_type", "valid_mac", "logger",
+                       "logger_limited"]
+
+
+class StorageUnavailable(Exception):
+    """Errore sollevato da :class:`OfflineStorage` quando il database non e' raggiungibile."""
+    pass
+
+
+# errori dei database supportati
+storage_errors = (StorageUnavailable, sqlite3.Error) + ((mysql.connector.Error,) if mysql is not None else ())
+
+# errori di connessione (temporanei): i dati possono essere salvati nello spool e reinseriti in seguito,
+# gli altri errori (ex. IntegrityError, tipo di dato non valido) si ripeterebbero a ogni tentativo
+storage_unavailable_errors = (StorageUnavailable, sqlite3.OperationalError) + (
+    (mysql.connector.OperationalError, mysql.connector.InterfaceError) if mysql is not None else ())
+
+
+class Settings:
+    """
+    Impostazioni del programma, lette e validate una sola volta con :meth:`load()`.
+
+    Ogni proprieta' di <schema> diventa un attributo con il tipo indicato
+    (ex. ``settings.mqtt_port``, ``settings.cache_ttl``); le proprieta' assenti
+    mantengono il valore di default. Il valore di una proprieta' puo' essere
+    sostituito dalla variabile d'ambiente ``MQTT_MANAGER_<SEZIONE>_<PROPRIETA'>``
+    (ex. ``MQTT_MANAGER_DATABASE_PASSWORD``, ``MQTT_MANAGER_MQTT_BROKER_HOST``).
+
+    Le sezioni in <reloadable_sections> (performance, log e validazione)
+    possono essere aggiornate a runtime con :meth:`update()` (segnale SIGHUP),
+    le altre richiedono il riavvio del programma.
+    """
 
-boold = False  # True = visualizza messaggi di debug
-conn = None  # oggetto connessione mysql
+    # (attributo, sezione, proprieta', tipo, default), default None = proprieta' obbligatoria
+    schema = [("db_username", "Database", "username", str, None),
+              ("db_password", "Database", "password", str, None),
+              ("db_host", "Database", "host", str, None),
+              ("db_database", "Database", "database", str, None),
+              ("db_timeout", "Database", "timeout", int, 10),
+              ("mqtt_username", "MQTT broker", "username", str, None),
+              ("mqtt_password", "MQTT broker", "password", str, None),
+              ("mqtt_host", "MQTT broker", "host", str, None),
+              ("mqtt_port", "MQTT broker", "port", int, None),
+              ("mqtt_qos", "MQTT broker", "qos", int, 1),                       # QoS delle iscrizioni
+              ("mqtt_clean_session", "MQTT broker", "clean_session", bool, False),  # False = sessione persistente
+              ("mqtt_min_delay", "MQTT broker", "min_delay", float, 1.0),      # attesa minima prima di riconnettersi
+              ("mqtt_max_delay", "MQTT broker", "max_delay", float, 10.0),     # attesa massima prima di riconnettersi
+              ("storage_backend", "Storage", "backend", str, "mysql"),
+              ("storage_path", "Storage", "path", str, "mqtt_manager.db"),
+              ("profiling_topic", "Profiling", "topic", str, ""),              # "" = topic disattivato
+              ("profiling_directory", "Profiling", "directory", str, "profiling"),
+              ("profiling_seconds", "Profiling", "seconds", int, 60),
+              ("profiling_sample", "Profiling", "sample", float, 0.1),
+              ("partition_period", "Partitioning", "interval", str, "day"),
+              ("partition_retention", "Partitioning", "retention", int, 0),
+              ("partition_ahead", "Partitioning", "ahead", int, 3),
+              ("partition_convert", "Partitioning", "convert", bool, False),
+              ("partition_tables", "Partitioning", "tables", list, ["t_type0_data"]),
+              ("validation_temp_min", "Validation", "temp_min", float, -40.0),
+              ("validation_temp_max", "Validation", "temp_max", float, 80.0),
+              ("validation_hum_min", "Validation", "hum_min", float, 0.0),
+              ("validation_hum_max", "Validation", "hum_max", float, 100.0),
+              ("validation_rssi_min", "Validation", "rssi_min", float, -120.0),
+              ("validation_rssi_max", "Validation", "rssi_max", float, 0.0),
+              ("validation_temp_rate", "Validation", "temp_rate", float, 0.1),
+              ("validation_hum_rate", "Validation", "hum_rate", float, 0.5),
+              ("validation_zscore", "Validation", "zscore", float, 4.0),
+              ("validation_min_std", "Validation", "min_std", float, 0.5),
+              ("validation_window", "Validation", "window", int, 30),
+              ("validation_min_history", "Validation", "min_history", int, 10),
+              ("validation_reseed", "Validation", "reseed", int, 5),
+              ("batch_size", "Performance", "batch_size", int, 5000),          # righe per INSERT di mqtt_import
+              ("cache_ttl", "Performance", "cache_ttl", float, 300.0),         # validita' di nodi e tipi in memoria
+              ("dedup_size", "Performance", "dedup_size", int, 1000),          # messaggi ricordati per i duplicati
+              ("spool_interval", "Performance", "spool_interval", float, 5.0),  # secondi tra i replay dello spool
+              ("partition_interval", "Performance", "partition_interval", float, 3600.0),  # controlli partizioni
+              ("snapshot_interval", "Performance", "snapshot_interval", float, 60.0),  # salvataggi dello snapshot
+              ("log_level", "Log", "level", str, "info"),                      # info, warning o error
+              ("log_debug", "Log", "debug", bool, False),                      # True = visualizza i messaggi
+              ("log_interval", "Log", "interval", float, 60.0),                # riepiloghi dei messaggi ripetuti
+              ("log_max_keys", "Log", "max_keys", int, 1000)]                  # messaggi diversi per intervallo
+
+    reloadable_sections = ("Performance", "Log", "Validation")
+    log_levels = {"info": 0, "warning": 1, "error": 2}
+    env_prefix = "MQTT_MANAGER_"
+
+    def __init__(self):
+        for attribute, section, key, kind, default in self.schema:
+            setattr(self, attribute, default)
+
+        self.sections = set()  # sezioni presenti nella configurazione
+
+    @classmethod
+    def load(cls, t_configfile, t_required=("MQTT broker",)):
+        """
+        Legge il file di configurazione e le variabili d'ambiente e restituisce le impostazioni validate.
+
+        Le proprieta' obbligatorie vengono controllate per le sezioni <t_required>
+        e per la sezione 'Database' se il backend e' MySQL.
+
+        :param str t_configfile: stringa, percorso del file di configurazione
+        :param tuple t_required: sezioni con le proprieta' obbligatorie
+        :return t_settings: impostazioni
+        :rtype: Settings
+        """
+        if not os.path.isfile(t_configfile):
+            raise Exception("Il file di configurazione '{}' non esiste".format(t_configfile))
+
+        config = configparser.ConfigParser()
+        config.read(t_configfile)
+
+        t_settings = cls()
+        t_settings.sections.update(config.sections())
+
+        for attribute, section, key, kind, default in cls.schema:
+            value = os.environ.get(cls.env_name(section, key))
+            if value is None and section in config:
+                value = config[section].get(key)
+
+            if value is not None:
+                t_settings.sections.add(section)
+                setattr(t_settings, attribute, cls.convert(value, kind, section, key))
+
+        t_settings.validate(t_required)
+
+        return t_settings
+
+    @classmethod
+    def env_name(cls, t_section, t_key):
+        """
+        Restituisce il nome della variabile d'ambiente che sostituisce la proprieta' <t_key> della sezione <t_section>.
+
+        :param str t_section: nome della sezione
+        :param str t_key: nome della proprieta'
+        :return name: ex. MQTT_MANAGER_MQTT_BROKER_HOST
+        :rtype: str
+        """
+        return (cls.env_prefix + t_section + "_" + t_key).upper().replace(" ", "_")
+
+    @staticmethod
+    def convert(t_value, t_kind, t_section, t_key):
+        """
+        Converte il valore letto <t_value> nel tipo <t_kind>.
+
+        :param str t_value: valore letto dal file o dalla variabile d'ambiente
+        :param type t_kind: str, int, float, bool o list (valori separati da virgola)
+        :param str t_section: nome della sezione (per il messaggio di errore)
+        :param str t_key: nome della proprieta' (per il messaggio di errore)
+        :return value: valore convertito
+        """
+        try:
+            if t_kind is bool:
+                return configparser.ConfigParser.BOOLEAN_STATES[t_value.strip().lower()]
+            if t_kind is list:
+                return [item.strip() for item in t_value.split(",") if item.strip()]
+            return t_kind(t_value.strip()) if t_kind is not str else t_value
+
+        except (ValueError, KeyError):
+            raise Exception("'{}' della sezione '{}' non valido: '{}'".format(t_key, t_section, t_value))
+
+    def validate(self, t_required):
+        """
+        Controlla le proprieta' obbligatorie e i valori ammessi.
+
+        :param tuple t_required: sezioni con le proprieta' obbligatorie
+        """
+        self.storage_backend = self.storage_backend.lower()
+        self.partition_period = self.partition_period.lower()
+        self.log_level = self.log_level.lower()
+
+        required = list(t_required) + (["Database"] if self.storage_backend == "mysql" else [])
+
+        for section in required:
+            if section not in self.sections:
+                raise Exception("Sezione '{}' non presente nel file configurazione".format(section))
+
+        for attribute, section, key, kind, default in self.schema:
+            if section in required and getattr(self, attribute) is None:
+                raise Exception("'{}' non presente nella sezione '{}' della configurazione".format(key, section))
+
+        if self.storage_backend not in ("mysql", "sqlite"):
+            raise Exception("Backend '{}' della sezione 'Storage' non supportato".format(self.storage_backend))
+
+        if self.partition_period not in ("day", "month"):
+            raise Exception("'interval' della sezione 'Partitioning' deve essere 'day' o 'month'")
+
+        for table in self.partition_tables:
+            if not re.match("^[0-9a-zA-Z_]+$", table):
+                raise Exception("Nome tabella '{}' della sezione 'Partitioning' non valido".format(table))
+
+        if self.log_level not in self.log_levels:
+            raise Exception("'level' della sezione 'Log' deve essere uno tra: {}".format(", ".join(self.log_levels)))
+
+        if self.mqtt_qos not in (0, 1, 2):
+            raise Exception("'qos' della sezione 'MQTT broker' deve essere 0, 1 o 2")
+
+        if not 0 < self.mqtt_min_delay <= self.mqtt_max_delay:
+            raise Exception("'min_delay' e 'max_delay' della sezione 'MQTT broker' non validi")
+
+        for attribute in ("batch_size", "dedup_size", "log_max_keys", "validation_window"):
+            if getattr(self, attribute) < 1:
+                raise Exception("'{}' deve essere maggiore di 0".format(attribute))
+
+        if "Validation" in self.sections and np is None:
+            raise Exception("La validazione dei dati richiede la libreria numpy")
+
+    def update(self, t_settings):
+        """
+        Copia da <t_settings> le proprieta' delle sezioni in <reloadable_sections>.
+
+        Le altre proprieta' non vengono modificate: la connessione al broker
+        e al database resta attiva.
+
+        :param Settings t_settings: impostazioni rilette dal file di configurazione
+        :return ignored: proprieta' modificate che richiedono il riavvio ("sezione.proprieta'")
+        :rtype: list
+        """
+        ignored = []
+
+        for attribute, section, key, kind, default in self.schema:
+            value = getattr(t_settings, attribute)
+            if section in self.reloadable_sections:
+                setattr(self, attribute, value)
+            elif value != getattr(self, attribute):
+                ignored.append(section + "." + key)
+
+        for section in self.reloadable_sections:
+            if section in t_settings.sections:
+                self.sections.add(section)
+            else:
+                self.sections.discard(section)
+
+        return ignored
 
-configfile_path = "config.ini"
+
+settings = Settings()  # impostazioni di default, sostituite all'avvio da Settings.load()
 
 ##################################################################################################################
 #                                                                                                                #
@@ -40,25 +332,40 @@ configfile_path = "config.ini"
 ##################################################################################################################
 
 
-def on_connect(t_client, userdata, flags, rc):
+def on_connect(t_client, userdata, flags, reason_code, properties):
     """
     A connessione con il broker MQTT avvenuta si iscrive ai maintopic.
 
     Un for loop fa iscrivere il client a tutti i maintopic in <maintopics>
+    con il QoS ``settings.mqtt_qos`` (di default 1, i messaggi vengono confermati
+    al broker da :func:`on_message()` solo dopo essere stati elaborati).
     
     :param t_client: client MQTT
     :param userdata:
-    :param flags:
-    :param rc: codice di stato
+    :param flags: flag di connessione (sessione presente)
+    :param reason_code: codice di stato
+    :param properties: proprieta' MQTT 5 (non usate)
     """
 
-    logger("Connesso con codice stato: " + str(rc), logfile)
+    global reconnect_delay
+
+    logger("Connesso con codice stato: {} (sessione presente: {})".format(reason_code, flags.session_present),
+           logfile)
 
     try:
+        # connessione riuscita: il prossimo tentativo di riconnessione riparte dall'attesa minima
+        if not reason_code.is_failure:
+            reconnect_delay = settings.mqtt_min_delay
+
         # iscriviti ai maintopic
         for maintopic in maintopics:
             logger("Iscritto al maintopic: " + maintopic["name"] + "/+", logfile)
-            t_client.subscribe(maintopic["name"] + "/+")
+            t_client.subscribe(maintopic["name"] + "/+", qos=settings.mqtt_qos)
+
+        # iscriviti al topic di amministrazione del profiling (se configurato)
+        if settings.profiling_topic:
+            logger("Iscritto al topic di profiling: " + settings.profiling_topic, logfile)
+            t_client.subscribe(settings.profiling_topic)
 
     except Exception as t_e:
         logger("ERROR: on_connect(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno, t_e),
@@ -77,6 +384,21 @@ def on_message(t_client, userdata, msg):
     verifica con valid_mac() se l'indirizzo MAC <macaddress> e' valido e infine
     controlla se il <maintopic> e' riconosciuto dal programma (e' presente in <maintopics>).
 
+    Il messaggio viene confermato al broker (PUBACK, il client e' creato con ``manual_ack``)
+    solo alla fine dell'elaborazione: se la funzione del maintopic restituisce False
+    (ex. :func:`manage_data()` non e' riuscita a salvare i dati ne' nel database ne' nello spool)
+    o il programma termina durante l'elaborazione il messaggio non viene confermato
+    e il broker lo reinvia alla prossima connessione. I messaggi non validi vengono confermati
+    (un nuovo invio non li renderebbe validi).
+
+    I messaggi reinviati dal broker (flag dup) gia' elaborati vengono ignorati (e confermati):
+    con QoS 1 il broker li reinvia se non ha ricevuto la conferma (PUBACK),
+    con lo stesso packet identifier (mid) dell'invio originale. Un messaggio viene
+    riconosciuto da topic, mid e payload: le letture identiche di un nodo (frequenti
+    con valori stabili) hanno mid diversi e non vengono scambiate per duplicati.
+    Limite: un broker che riusa subito lo stesso mid per un messaggio identico dello stesso topic
+    (entro gli ultimi <settings.dedup_size> messaggi) renderebbe il reinvio indistinguibile.
+
     Se il maintopic e' riconosciuto allora viene richiamata la sua funzione:
     - maintopic "presentation": viene richiamata la funzione manage_presentation()
     - maintopic "data": viene richiamata la funzione manage_data()
@@ -86,6 +408,9 @@ def on_message(t_client, userdata, msg):
     :param msg: messaggio MQTT, contiene stringa JSON
     """
 
+    message_key = (msg.topic, msg.mid, msg.payload)
+    processed = True  # False = dati non salvati, il messaggio non viene confermato
+
     try:
         # dividi maintopic dal mac address
         topic_split = msg.topic.split("/")
@@ -94,7 +419,17 @@ def on_message(t_client, userdata, msg):
         message = json.loads(msg.payload.decode())
 
         logger("Nuovo messaggio sul topic: {} ({})".format(msg.topic, message), logfile)
-        
+
+        # ignora i messaggi reinviati dal broker se sono gia' stati elaborati
+        if msg.dup and message_key in recent_messages:
+            logger_limited("WARNING: messaggio duplicato sul topic '{}' ignorato".format(msg.topic), logfile)
+            return
+
+        # messaggio di amministrazione del profiling
+        if settings.profiling_topic and msg.topic == settings.profiling_topic:
+            manage_profiling(message)
+            return
+
         # dovrebbe contenere due elementi
         if len(topic_split) == 2:
             logger("Formato topic '{}' valido".format(msg.topic), logfile)
@@ -117,39 +452,50 @@ def on_message(t_client, userdata, msg):
                     if maintopics[i]["name"] == message_topic:
                         logger("Maintopic '{}' valido".format(message_topic), logfile)
                         found_maintopic = True
-                        maintopics[i]["function"](macaddr, message)
+                        processed = maintopics[i]["function"](macaddr, message) is not False
 
                     i += 1
 
                 # se il maintopic non e' stato trovato salva messaggio di log
                 if not found_maintopic:
-                    logger("WARNING: Maintopic '{}' non trovato".format(message_topic), logfile)
+                    logger_limited("WARNING: Maintopic '{}' non trovato".format(message_topic), logfile)
 
             # MAC address non valido
             else:
-                logger("WARNING: mac address '{}' non valido".format(macaddr), logfile)
+                logger_limited("WARNING: mac address '{}' non valido".format(macaddr), logfile)
 
         # formato topic non valido
         else:
-            logger("WARNING: formato topic '{}' non valido".format(msg.topic), logfile)
+            logger_limited("WARNING: formato topic '{}' non valido".format(msg.topic), logfile)
 
     except Exception as t_e:
-        logger("ERROR: on_message(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno, t_e),
-               logfile)
+        logger_limited("ERROR: on_message(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                            t_e),
+                       logfile)
 
+    # conferma il messaggio al broker (con QoS 0 non viene inviato niente)
+    finally:
+        if processed:
+            if message_key not in recent_messages:
+                recent_messages.append(message_key)
+            t_client.ack(msg.mid, msg.qos)
 
-def on_disconnect(t_client, userdata, rc=0):
+
+def on_disconnect(t_client, userdata, flags, reason_code, properties):
     """
     Funzione richiamata in caso di disconnessione.
 
-    Questa funzione non dovrebbe essere richiamata MAI.
+    La riconnessione viene gestita da :func:`mqtt_loop()`:
+    con la sessione persistente il broker conserva i messaggi
+    ricevuti durante la disconnessione (e quelli non confermati) e li invia alla riconnessione.
 
     :param t_client: client MQTT
     :param userdata:
-    :param rc: status disconnessione
+    :param flags: flag di disconnessione
+    :param reason_code: status disconnessione
+    :param properties: proprieta' MQTT 5 (non usate)
     """
-    logger("Disconnesso con codice: " + str(rc), logfile)
-    t_client.loop_stop()
+    logger("Disconnesso con codice: " + str(reason_code), logfile)
 
 
 ##################################################################################################################
@@ -163,48 +509,108 @@ def manage_data(t_macaddr, t_msg):
     """
     Gestisce i messaggi MQTT con dati.
 
+    Inserisce i dati nel database con :func:`insert_data()` e conferma le modifiche.
+    Se il database non e' raggiungibile (<storage_unavailable_errors>) viene sostituito da
+    :class:`OfflineStorage` con :func:`storage_offline()`, i dati vengono salvati nello spool
+    con :func:`spool_write()` e reinseriti nel DB da :func:`spool_replay()`.
+    Se non e' possibile scrivere nemmeno lo spool la funzione restituisce False:
+    :func:`on_message()` non conferma il messaggio al broker, che lo reinviera'.
+    I dati rifiutati dal database (ex. tipo non valido) vengono scartati: un nuovo tentativo fallirebbe.
+
+    I dati gia' validati vengono salvati nello spool come validati (non vengono
+    validati di nuovo da :func:`spool_replay()`), quelli scartati non vengono salvati.
+
+    :param str t_macaddr: stringa, indirizzo MAC
+    :param dict t_msg: messaggio MQTT decodificato
+    :return: False se i dati non sono stati salvati
+    :rtype: bool
+    """
+    global validated_rows
+
+    timestamp = int(time.time())
+    validated_rows = None
+
+    try:
+        insert_data(t_macaddr, t_msg, timestamp)
+        storage.commit()
+
+    # database non raggiungibile: salva i dati nello spool
+    except storage_unavailable_errors as t_e:
+        if validated_rows == []:
+            # lettura scartata e gia' messa in quarantena: non c'e' niente da salvare
+            return
+
+        logger_limited("WARNING: manage_data(), dati del nodo '{}' salvati nello spool: '{}'".format(t_macaddr, t_e),
+                       logfile, "spool " + t_macaddr)
+        storage_offline()
+        try:
+            spool_write(t_macaddr, t_msg, timestamp, validated_rows is not None)
+        except OSError as t_e:
+            logger_limited("ERROR: manage_data(), impossibile salvare nello spool i dati del nodo '{}',"
+                           " messaggio non confermato: '{}'".format(t_macaddr, t_e), logfile, "spool " + t_macaddr)
+            return False
+
+    # dati rifiutati dal database: annulla le modifiche del messaggio
+    except storage_errors as t_e:
+        logger_limited("ERROR: manage_data(), dati del nodo '{}' rifiutati dal database: '{}'".format(t_macaddr, t_e),
+                       logfile, "manage_data " + t_macaddr)
+        try:
+            storage.rollback()
+        except storage_errors:
+            pass
+
+    # errore sconosciuto (limitato per nodo: un nodo guasto puo' inviare molti messaggi)
+    except Exception as t_e:
+        logger_limited("ERROR: manage_data() errore sconosciuto sul nodo '{}' alla riga '{}': '{}'".format(
+            t_macaddr, sys.exc_info()[2].tb_lineno, t_e), logfile, "manage_data " + t_macaddr)
+
+
+def insert_data(t_macaddr, t_msg, t_timestamp, t_validate=True):
+    """
+    Inserisce nel database i dati del nodo con indirizzo MAC <t_macaddr>.
+
     ottiene id e tipo di nodo dal database e gestisce
     i dati attraverso la funzione adatta:
     - per i nodi di tipo 0 viene richiamata la funzione manage_data_type0()
 
+    Le modifiche non vengono confermate (commit) e gli errori del database
+    (<storage_errors>) vengono propagati al chiamante.
+
     :param str t_macaddr: stringa, indirizzo MAC
     :param dict t_msg: messaggio MQTT decodificato
+    :param int t_timestamp: timestamp di ricezione dei dati
+    :param bool t_validate: False = dati gia' validati (ex. reinseriti dallo spool)
     """
-    try:
-        # ottieni dati nodo
-        node_data = get_node(t_macaddr)
+    # ottieni dati nodo
+    node_data = get_node(t_macaddr)
 
-        # controlla quantita' dati ottenuta del nodo
-        if len(node_data) == 1:
-            node_id = node_data[0][0]
-            node_type = node_data[0][2]
+    # controlla quantita' dati ottenuta del nodo
+    if len(node_data) == 1:
+        node_id = node_data[0][0]
+        node_type = node_data[0][2]
 
-            if node_type == 0:
-                manage_data_type0(node_id, t_msg)
-            else:
-                # tipo sconosciuto: non e' supportato dal sistema e occorre aggiungerlo al DB
-                logger("WARNING: tipo nodo '{}' sconosciuto, non e' possibile inserire i dati".format(node_type),
-                       logfile)
+        if node_type == 0:
+            manage_data_type0(node_id, t_msg, t_timestamp, t_validate)
         else:
-            logger("WARNING: manage_data(), numero informazioni nodo '{}' irregolare".format(t_macaddr), logfile)
-
-    # errore sconosciuto
-    except Exception as t_e:
-        logger("ERROR: manage_data() errore sconosciuto sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno, t_e),
-               logfile)
+            # tipo sconosciuto: non e' supportato dal sistema e occorre aggiungerlo al DB
+            logger_limited("WARNING: tipo nodo '{}' sconosciuto, non e' possibile inserire i dati".format(node_type),
+                           logfile)
+    else:
+        logger_limited("WARNING: manage_data(), numero informazioni nodo '{}' irregolare".format(t_macaddr), logfile)
 
 
-def manage_data_type0(t_nodeid, t_msg):
+def manage_data_type0(t_nodeid, t_msg, t_timestamp, t_validate=True):
     """
     Inserisce i dati dei nodi di tipo 0 nel database.
 
-    Esegue l'istruzione SQL per inserire i dati.
+    Inserisce i dati con :func:`add_type0_data()` (che li valida),
+    la conferma delle modifiche (commit) e' a carico del chiamante.
 
     :param int t_nodeid: identificativo del nodo
     :param dict t_msg: messaggio MQTT decodificato
+    :param int t_timestamp: timestamp di ricezione dei dati
+    :param bool t_validate: False = dati gia' validati
     """
-    timestamp = int(time.time())
-
     try:
         # ottieni dal messaggio temperatura, umidita' e rssi
         temp = t_msg["temperature"]
@@ -212,13 +618,284 @@ def manage_data_type0(t_nodeid, t_msg):
         rssi = t_msg["rssi"]
 
         # inserisci i dati nella tabella dei dati di tipo 0
-        query = "INSERT INTO t_type0_data (tstamp, node_id, temp, hum, rssi) VALUES (%s, %s, %s, %s, %s)"
-        cursor.execute(query, [timestamp, t_nodeid, temp, hum, rssi])
-        conn.commit()
+        add_type0_data([(t_timestamp, t_nodeid, temp, hum, rssi)], t_validate)
+
+    # errori del database: gestiti dal chiamante
+    except storage_errors:
+        raise
 
+    # messaggio non valido (ex. senza temperatura): limitato per nodo
     except Exception as t_e:
-        logger("ERROR: manage_data_type0() errore sconosciuto sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno,
-                                                                                            t_e),
+        logger_limited("ERROR: manage_data_type0() errore sul nodo '{}' alla riga '{}': '{}'".format(
+            t_nodeid, sys.exc_info()[2].tb_lineno, t_e), logfile, "manage_data_type0 {}".format(t_nodeid))
+
+
+####################
+#
+# VALIDATION FUNCTIONS
+#
+####################
+
+
+def add_type0_data(t_rows, t_validate=True):
+    """
+    Valida i dati dei nodi di tipo 0 e inserisce nel database quelli validi.
+
+    Le letture accettate vengono salvate in <validated_rows> (usato da :func:`manage_data()`
+    per decidere cosa salvare nello spool).
+
+    :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+    :param bool t_validate: False = dati gia' validati, vengono inseriti senza controlli
+    """
+    global validated_rows
+
+    rows = validate_type0(t_rows) if t_validate else t_rows
+    validated_rows = rows
+
+    if rows:
+        storage.add_type0_data(rows)
+
+
+def validation_conf(t_settings):
+    """
+    Restituisce le impostazioni della validazione dei dati come array numpy.
+
+    La sezione 'Validation' e' facoltativa, se non e' presente
+    viene restituito None (validazione disattivata). Proprieta' (default per i DHT22):
+
+    - temp_min, temp_max, hum_min, hum_max, rssi_min, rssi_max: intervalli validi
+      (-40/80 gradi, 0/100 %, -120/0 dBm)
+    - temp_rate, hum_rate: variazione massima al secondo rispetto all'ultima lettura valida (0.1, 0.5)
+    - zscore: z-score massimo rispetto alle ultime letture del nodo (4)
+    - min_std: deviazione standard minima usata per lo z-score (0.5)
+    - window: numero di letture ricordate per ogni nodo (30)
+    - min_history: letture necessarie per applicare lo z-score (10)
+    - reseed: letture consecutive scartate dallo z-score dopo cui la storia del nodo
+      viene sostituita con queste letture (5, 0 = mai)
+
+    :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+    :return config: dizionario con le impostazioni o None
+    :rtype: dict
+    """
+    if "Validation" not in t_settings.sections:
+        return None
+
+    config = {"min": np.array([t_settings.validation_temp_min,
+                               t_settings.validation_hum_min,
+                               t_settings.validation_rssi_min]),
+              "max": np.array([t_settings.validation_temp_max,
+                               t_settings.validation_hum_max,
+                               t_settings.validation_rssi_max]),
+              "rate": np.array([t_settings.validation_temp_rate,
+                                t_settings.validation_hum_rate]),
+              "zscore": t_settings.validation_zscore,
+              "min_std": t_settings.validation_min_std,
+              "window": t_settings.validation_window,
+              "min_history": t_settings.validation_min_history,
+              "reseed": t_settings.validation_reseed}
+
+    return config
+
+
+def to_float(t_value):
+    """
+    Converte <t_value> in float, restituisce NaN se non e' un numero.
+
+    :param t_value: valore da convertire
+    :return value: valore convertito
+    :rtype: float
+    """
+    try:
+        return float(t_value)
+    except (ValueError, TypeError):
+        return float("nan")
+
+
+def validate_type0(t_rows):
+    """
+    Restituisce le letture dei nodi di tipo 0 valide e mette in quarantena le altre.
+
+    Le letture vengono convertite in un array NumPy (una colonna per
+    tstamp, node_id, temp, hum, rssi) e controllate con operazioni vettoriali:
+
+    1. valori NaN, infiniti o non numerici
+    2. valori fuori dagli intervalli validi
+    3. variazione al secondo di temperatura/umidita' rispetto all'ultima lettura accettata
+       dello stesso nodo (nel blocco o nella storia del nodo) oltre il massimo
+    4. z-score robusto (mediana e MAD) di temperatura/umidita' rispetto alle ultime letture
+       del nodo e a quelle del blocco oltre il massimo
+
+    Gli esiti vengono contati in <validation_stats> (riassunti nel log da :func:`validation_summary()`)
+    e le letture scartate vengono salvate nel file <quarantine_path>.
+    Solo le letture valide vengono aggiunte alla storia del nodo: una lettura scartata
+    non fa scartare quelle successive. Dopo <reseed> letture consecutive scartate dallo z-score
+    (ex. un cambiamento reale della temperatura) la storia del nodo viene sostituita con queste
+    letture, che restano in quarantena: le successive vengono confrontate con i nuovi valori
+    (in un blocco, a partire dal blocco successivo).
+    Se la validazione e' disattivata restituisce <t_rows>.
+
+    :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+    :return rows: lista delle tuple valide
+    :rtype: list
+    """
+    if validation_config is None or not t_rows:
+        return t_rows
+
+    config = validation_config
+
+    try:
+        data = np.array(t_rows, dtype=float)
+    except (ValueError, TypeError):
+        # valori non numerici: converti uno alla volta
+        data = np.array([[to_float(value) for value in row] for row in t_rows], dtype=float)
+
+    tstamp = data[:, 0]
+    node = data[:, 1]
+    values = data[:, 2:5]                 # temp, hum, rssi
+    reason = np.zeros(len(t_rows), dtype=int)  # codice in <validation_reasons>, 0 = valida
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # 1. NaN e infiniti
+        reason[~np.isfinite(data).all(axis=1)] = 1
+
+        # 2. intervalli validi
+        out_of_range = ((values < config["min"]) | (values > config["max"])).any(axis=1)
+        reason[(reason == 0) & out_of_range] = 2
+        plausible = reason == 0
+
+        # statistiche di ogni nodo: ultimo tstamp e ultima temp/hum della storia,
+        # mediana e deviazione (MAD) di temp/hum della storia e delle letture plausibili del blocco
+        nodes = np.unique(node)
+        history_stats = np.full((len(nodes), 7), np.nan)
+        for i, node_id in enumerate(nodes):
+            history = validation_history.get(node_id)
+            window_values = values[plausible & (node == node_id), 0:2]
+            if history:
+                history_data = np.array(history)
+                history_stats[i, 0:3] = history_data[-1]
+                window_values = np.concatenate((history_data[:, 1:3], window_values))
+
+            if len(window_values) >= config["min_history"]:
+                median = np.median(window_values, axis=0)
+                deviation = 1.4826 * np.median(np.abs(window_values - median), axis=0)
+                history_stats[i, 3:5] = median
+                history_stats[i, 5:7] = np.maximum(deviation, config["min_std"])
+        row_stats = history_stats[np.searchsorted(nodes, node)]
+
+        # 4. z-score robusto rispetto alle letture del nodo (NaN se sono troppo poche: nessun controllo)
+        zscore = np.abs(values[:, 0:2] - row_stats[:, 3:5]) / row_stats[:, 5:7]
+        reason[(reason == 0) & (zscore > config["zscore"]).any(axis=1)] = 4
+
+        # 3. variazione al secondo rispetto all'ultima lettura accettata precedente dello stesso nodo:
+        # ordina per nodo e tstamp e cerca per ogni riga l'indice dell'ultima riga valida precedente
+        order = np.lexsort((tstamp, node))
+        sorted_node = node[order]
+        sorted_tstamp = tstamp[order]
+        sorted_values = values[order, 0:2]
+        valid_index = np.where(reason[order] == 0, np.arange(len(order)), -1)
+        previous = np.concatenate(([-1], np.maximum.accumulate(valid_index)[:-1]))
+        same_node = (previous >= 0) & (sorted_node[previous] == sorted_node)
+
+        # senza una lettura precedente nel blocco usa l'ultima della storia del nodo
+        previous_tstamp = np.where(same_node, sorted_tstamp[previous], row_stats[order, 0])
+        previous_values = np.where(same_node[:, None], sorted_values[previous], row_stats[order, 1:3])
+        rate = np.abs(sorted_values - previous_values) / np.maximum(sorted_tstamp - previous_tstamp, 1)[:, None]
+        too_fast = (reason[order] == 0) & (rate > config["rate"]).any(axis=1)
+
+    # una lettura scartata per la variazione non e' il riferimento della successiva:
+    # per i nodi con letture troppo rapide il controllo viene ripetuto una lettura alla volta
+    if too_fast.any():
+        rate_temp, rate_hum = config["rate"]
+        for node_id in np.unique(sorted_node[too_fast]):
+            history = validation_history.get(node_id)
+            last = history[-1] if history else None
+
+            for i in order[(sorted_node == node_id) & (reason[order] == 0)]:
+                if last is not None:
+                    elapsed = max(tstamp[i] - last[0], 1)
+                    if (abs(values[i, 0] - last[1]) / elapsed > rate_temp or
+                            abs(values[i, 1] - last[2]) / elapsed > rate_hum):
+                        reason[i] = 3
+                        continue
+                last = (tstamp[i], values[i, 0], values[i, 1])
+
+    # aggiorna la storia dei nodi con le letture valide e con le serie di letture scartate dallo z-score
+    for row_index in np.flatnonzero((reason[order] == 0) | (reason[order] == 4)):
+        row = data[order[row_index]]
+        history = validation_history.get(row[1])
+        if history is None:
+            history = validation_history[row[1]] = collections.deque(maxlen=config["window"])
+        outliers = validation_outliers.setdefault(row[1], [])
+
+        if reason[order[row_index]] == 0:
+            history.append((row[0], row[2], row[3]))
+            outliers.clear()
+
+        elif config["reseed"]:
+            outliers.append((row[0], row[2], row[3]))
+            if len(outliers) >= config["reseed"]:
+                logger_limited("WARNING: validate_type0(), storia del nodo '{}' sostituita dopo {} letture"
+                               " consecutive scartate dallo z-score".format(int(row[1]), len(outliers)), logfile,
+                               "reseed {}".format(int(row[1])))
+                history.clear()
+                history.extend(outliers)
+                outliers.clear()
+
+    # conta gli esiti e metti in quarantena le letture scartate
+    for code, count in enumerate(np.bincount(reason, minlength=len(validation_reasons))):
+        validation_stats[validation_reasons[code]] += int(count)
+
+    rejected = np.flatnonzero(reason)
+    if len(rejected):
+        quarantine(t_rows, rejected, reason)
+
+    return [t_rows[i] for i in np.flatnonzero(reason == 0)]
+
+
+def validation_summary():
+    """
+    Scrive nel log quante letture sono state accettate e scartate (per motivo) dall'ultimo riepilogo.
+
+    Viene richiamata da :func:`mqtt_loop()` ogni <settings.log_interval> secondi;
+    se ci sono letture scartate il riepilogo e' un avviso (WARNING).
+    """
+    global validation_logged
+
+    counts = {reason: validation_stats[reason] - validation_logged[reason] for reason in validation_reasons}
+    rejected = sum(counts.values()) - counts["valid"]
+    seconds = int(time.time() - log_interval_start)
+
+    if rejected:
+        logger("WARNING: validazione dei dati negli ultimi {} secondi: {} letture valide, {} scartate ({})".format(
+            seconds, counts["valid"], rejected,
+            ", ".join("{} {}".format(reason, counts[reason]) for reason in validation_reasons[1:])), logfile)
+    elif counts["valid"]:
+        logger("Validazione dei dati negli ultimi {} secondi: {} letture valide".format(seconds, counts["valid"]),
+               logfile)
+
+    validation_logged = dict(validation_stats)
+
+
+def quarantine(t_rows, t_rejected, t_reason):
+    """
+    Salva nel file <quarantine_path> le letture scartate da :func:`validate_type0()`.
+
+    :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+    :param t_rejected: indici delle letture scartate
+    :param t_reason: codici dell'esito di ogni lettura
+    """
+    try:
+        with open(quarantine_path, "a") as quarantine_file:
+            for i in t_rejected:
+                tstamp, node_id, temp, hum, rssi = t_rows[i]
+                reason = validation_reasons[t_reason[i]]
+                quarantine_file.write(json.dumps({"tstamp": tstamp, "node_id": node_id, "temp": temp, "hum": hum,
+                                                  "rssi": rssi, "reason": reason}, default=str) + "\n")
+                logger_limited("WARNING: lettura del nodo '{}' scartata ({}): {}, {}, {}".format(
+                    node_id, reason, temp, hum, rssi), logfile, "quarantine {} {}".format(node_id, reason))
+
+    except Exception as t_e:
+        logger("ERROR: quarantine(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno, t_e),
                logfile)
 
 
@@ -352,9 +1029,8 @@ def add_newnode_options_type0(t_nodeid, t_msg):
         timebetweenread = t_msg["sketchTimeToWait"]
 
         # inserisci nella tabella delle impostazioni nodi di tipo 0 il timebetweenread
-        query = "INSERT INTO t_type0_options (node_id, timebetweenread) VALUES (%s, %s)"
-        cursor.execute(query, [t_nodeid, timebetweenread])
-        conn.commit()
+        storage.add_options_type0(t_nodeid, timebetweenread)
+        storage.commit()
     except Exception as t_e:
         logger("ERROR: add_newnode_options_type0(), errore sconosciuto sulla riga '{}': {}".format(
             sys.exc_info()[2].tb_lineno, t_e),
@@ -386,14 +1062,14 @@ def present_newnode(t_msg):
         # se il tipo di nodo e' conosciuto
         if len(nodetype_data) == 1:
             # inserisci in t_nodi: ip, id del tipo, mac e location_id=0
-            query = "INSERT INTO t_nodi (ip, type_id, mac, location_id) VALUES (%s, %s, %s, 0)"
-            cursor.execute(query, (ip, node_type, mac))
+            rowcount = storage.add_node(ip, node_type, mac)
 
             # controllo se il nodo e' stato inserito correttamente
-            if cursor.rowcount == 1:
-                conn.commit()  # confermo modifiche del DB
+            if rowcount == 1:
+                storage.commit()  # confermo modifiche del DB
 
-                # ottengo informazioni del node aggiunto per l'id
+                # ottengo informazioni del node aggiunto per l'id (non dalla memoria)
+                node_cache.pop(mac, None)
                 node_data = get_node(mac)
 
                 # controllo se ho ottenuto il numero giusto di dati (1)
@@ -442,7 +1118,7 @@ def present_oldnode(t_msg):
 
         # ottieni vecchi dati del node dal DB
         oldnode_data = get_node(mac)
-        oldnode_ip = oldnode_data[0][1].decode()
+        oldnode_ip = oldnode_data[0][1]
         oldnode_type = oldnode_data[0][2]
 
         if oldnode_ip == ip and oldnode_type == node_type:
@@ -455,11 +1131,10 @@ def present_oldnode(t_msg):
                 client.publish("options/" + mac, options)
         else:
             # le informazioni non sono aggiornate, aggiorna ip e tipo id dove mac = <mac>
-            query = "UPDATE t_nodi SET t_nodi.ip = %s, t_nodi.type_id = %s WHERE t_nodi.mac = %s"
-            cursor.execute(query, (ip, node_type, mac))
-            if cursor.rowcount == 1:
+            if storage.update_node(ip, node_type, mac) == 1:
                 # se l'aggiornamento ha avuto successo, conferma modifiche
-                conn.commit()
+                storage.commit()
+                node_cache.pop(mac, None)
 
                 # ottieni impostazioni del nodo e mandagliele
                 options = get_options(oldnode_data[0][0], node_type)
@@ -509,8 +1184,10 @@ def get_options_type0(t_nodeid):
     """
     Restituisce le impostazioni del nodo <t_nodeid> di tipo 0.
 
-    Esegue l'istruzione SQL per restituire node_id e timebetweenread (tempo tra rilevazioni)
-    del nodo <t_nodeid>.
+    Ottiene dal database node_id e timebetweenread (tempo tra rilevazioni)
+    del nodo <t_nodeid> con :meth:`Storage.get_options_type0()`.
+    Le impostazioni vengono memorizzate in <options_cache>: se il database
+    non e' raggiungibile vengono restituite le ultime impostazioni conosciute.
 
     :param int t_nodeid: identificativo del nodo
     :return options: tupla con impostazioni del nodo
@@ -519,15 +1196,20 @@ def get_options_type0(t_nodeid):
     options = None
 
     try:
-        query = "SELECT node_id, timebetweenread FROM t_type0_options WHERE node_id = %s"
-        cursor.execute(query, [t_nodeid])
-        options_data = cursor.fetchall()
+        options_data = storage.get_options_type0(t_nodeid)
 
         if len(options_data) == 1:
             options = "{'timeToWait': " + str(options_data[0][1]) + "}"
+            cache_set(options_cache, t_nodeid, options)
         else:
             logger("WARNING: numero opzioni del nodo '{}' errato".format(t_nodeid), logfile)
 
+    # database non raggiungibile: usa le ultime impostazioni conosciute
+    except storage_errors as t_e:
+        options = options_cache.get(t_nodeid, (0, None))[1]
+        logger("WARNING: get_options_type0(), database non raggiungibile, impostazioni del nodo '{}' "
+               "dallo snapshot: {} ('{}')".format(t_nodeid, options, t_e), logfile)
+
     except Exception as t_e:
         logger("ERROR: get_options_type0(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
                                                                                            t_e),
@@ -536,6 +1218,411 @@ def get_options_type0(t_nodeid):
     return options
 
 
+##################################################################################################################
+#                                                                                                                #
+#                                                 STORAGE CLASSES                                                #
+#                                                                                                                #
+##################################################################################################################
+
+
+class Storage:
+    """
+    Interfaccia del database usata dalle funzioni di gestione dei messaggi.
+
+    Contiene tutte le istruzioni SQL del programma (scritte con segnaposto ``%s``):
+    le sottoclassi :class:`MySQLStorage` e :class:`SQLiteStorage` si occupano
+    della connessione e delle differenze tra i database.
+
+    I metodi non confermano le modifiche: occorre richiamare :meth:`commit()`.
+
+    :param t_conn: oggetto connessione
+    :param t_cursor: cursore della connessione
+    """
+
+    def __init__(self, t_conn, t_cursor):
+        self.conn = t_conn
+        self.cursor = t_cursor
+
+    def execute(self, t_query, t_params):
+        """
+        Esegue l'istruzione SQL <t_query> con i parametri <t_params>.
+
+        :param str t_query: istruzione SQL con segnaposto ``%s``
+        :param t_params: lista/tupla con i parametri
+        """
+        self.cursor.execute(t_query, t_params)
+
+    def executemany(self, t_query, t_rows):
+        """
+        Esegue l'istruzione SQL <t_query> per ogni elemento di <t_rows>.
+
+        :param str t_query: istruzione SQL con segnaposto ``%s``
+        :param list t_rows: lista di liste/tuple con i parametri
+        """
+        self.cursor.executemany(t_query, t_rows)
+
+    def get_node(self, t_macaddr):
+        """
+        Restituisce id, ip, type_id del nodo con indirizzo MAC <t_macaddr>.
+
+        :param str t_macaddr: stringa con indirizzo MAC
+        :return node: lista di tuple (id, ip, type_id), ip e' una stringa
+        :rtype: list
+        """
+        query = "SELECT t_nodi.id, t_nodi.ip, t_nodi.type_id FROM t_nodi WHERE t_nodi.mac = %s"
+        self.execute(query, [t_macaddr])
+
+        return [(node_id, ip.decode() if isinstance(ip, (bytes, bytearray)) else ip, type_id)
+                for node_id, ip, type_id in self.cursor.fetchall()]
+
+    def get_type(self, t_typeid):
+        """
+        Restituisce id, description, category_id del tipo di nodo <t_typeid>.
+
+        :param int t_typeid: intero, identifica tipo di nodo
+        :return nodetype: lista di tuple (id, description, category_id)
+        :rtype: list
+        """
+        query = "SELECT t_types.id, t_types.description, t_types.category_id FROM t_types WHERE t_types.id = %s"
+        self.execute(query, [t_typeid])
+
+        return self.cursor.fetchall()
+
+    def get_nodes(self):
+        """
+        Restituisce mac, id, ip, type_id di tutti i nodi.
+
+        :return nodes: lista di tuple (mac, id, ip, type_id), ip e' una stringa
+        :rtype: list
+        """
+        self.execute("SELECT t_nodi.mac, t_nodi.id, t_nodi.ip, t_nodi.type_id FROM t_nodi", [])
+
+        return [(mac.decode() if isinstance(mac, (bytes, bytearray)) else mac, node_id,
+                 ip.decode() if isinstance(ip, (bytes, bytearray)) else ip, type_id)
+                for mac, node_id, ip, type_id in self.cursor.fetchall()]
+
+    def get_types(self):
+        """
+        Restituisce id, description, category_id di tutti i tipi di nodo.
+
+        :return nodetypes: lista di tuple (id, description, category_id)
+        :rtype: list
+        """
+        self.execute("SELECT t_types.id, t_types.description, t_types.category_id FROM t_types", [])
+
+        return self.cursor.fetchall()
+
+    def add_node(self, t_ip, t_typeid, t_macaddr):
+        """
+        Inserisce il nodo nella tabella t_nodi con location_id a 0 (sconosciuta).
+
+        :param str t_ip: indirizzo IP del nodo
+        :param int t_typeid: identificativo del tipo di nodo
+        :param str t_macaddr: indirizzo MAC del nodo
+        :return rowcount: numero di record inseriti
+        :rtype: int
+        """
+        query = "INSERT INTO t_nodi (ip, type_id, mac, location_id) VALUES (%s, %s, %s, 0)"
+        self.execute(query, (t_ip, t_typeid, t_macaddr))
+
+        return self.cursor.rowcount
+
+    def update_node(self, t_ip, t_typeid, t_macaddr):
+        """
+        Aggiorna ip e tipo del nodo con indirizzo MAC <t_macaddr>.
+
+        :param str t_ip: indirizzo IP del nodo
+        :param int t_typeid: identificativo del tipo di nodo
+        :param str t_macaddr: indirizzo MAC del nodo
+        :return rowcount: numero di record aggiornati
+        :rtype: int
+        """
+        query = "UPDATE t_nodi SET ip = %s, type_id = %s WHERE mac = %s"
+        self.execute(query, (t_ip, t_typeid, t_macaddr))
+
+        return self.cursor.rowcount
+
+    def add_type0_data(self, t_rows):
+        """
+        Inserisce i dati dei nodi di tipo 0 nella tabella t_type0_data.
+
+        :param list t_rows: lista di tuple (tstamp, node_id, temp, hum, rssi)
+        """
+        query = "INSERT INTO t_type0_data (tstamp, node_id, temp, hum, rssi) VALUES (%s, %s, %s, %s, %s)"
+        if len(t_rows) == 1:
+            self.execute(query, t_rows[0])
+        else:
+            self.executemany(query, t_rows)
+
+    def add_options_type0(self, t_nodeid, t_timebetweenread):
+        """
+        Inserisce le impostazioni del nodo di tipo 0 nella tabella t_type0_options.
+
+        :param int t_nodeid: identificativo del nodo
+        :param int t_timebetweenread: tempo tra le rilevazioni
+        """
+        query = "INSERT INTO t_type0_options (node_id, timebetweenread) VALUES (%s, %s)"
+        self.execute(query, [t_nodeid, t_timebetweenread])
+
+    def get_options_type0(self, t_nodeid):
+        """
+        Restituisce node_id e timebetweenread del nodo di tipo 0 <t_nodeid>.
+
+        :param int t_nodeid: identificativo del nodo
+        :return options: lista di tuple (node_id, timebetweenread)
+        :rtype: list
+        """
+        query = "SELECT node_id, timebetweenread FROM t_type0_options WHERE node_id = %s"
+        self.execute(query, [t_nodeid])
+
+        return self.cursor.fetchall()
+
+    def apply_retention(self, t_table, t_settings, t_time):
+        """
+        Elimina dalla tabella <t_table> i dati piu' vecchi del periodo di conservazione.
+
+        Vengono eliminati i record con tstamp precedente all'inizio del periodo
+        piu' vecchio da conservare (sezione 'Partitioning' di :class:`Settings`).
+        I database con partizioni (:class:`MySQLStorage`) eliminano invece le partizioni scadute.
+
+        :param str t_table: nome della tabella dei dati
+        :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+        :param int t_time: timestamp attuale
+        """
+        if t_settings.partition_retention > 0:
+            cutoff = period_start(t_settings.partition_period, t_time, 1 - t_settings.partition_retention)
+            self.execute("DELETE FROM " + t_table + " WHERE tstamp < %s", [cutoff])
+            self.commit()
+
+    def commit(self):
+        """Conferma le modifiche al database."""
+        self.conn.commit()
+
+    def rollback(self):
+        """Annulla le modifiche non confermate."""
+        self.conn.rollback()
+
+    def check(self):
+        """Si assicura che la connessione al database sia attiva."""
+        pass
+
+    def close(self):
+        """Chiude cursore e connessione."""
+        self.cursor.close()
+        self.conn.close()
+
+
+class MySQLStorage(Storage):
+    """
+    Database MySQL (server in rete).
+
+    Usa un cursore con prepared statements. Se la connessione cade
+    il database viene sostituito da :class:`OfflineStorage` (:func:`storage_offline()`)
+    e la riconnessione avviene in background con :func:`storage_reconnect()`.
+
+    :param t_conn: oggetto connessione restituito da :func:`mysql_conn()`
+    """
+
+    def __init__(self, t_conn):
+        super().__init__(t_conn, t_conn.cursor(prepared=True))
+
+    def check(self):
+        """
+        Si assicura che la connessione al database sia attiva.
+
+        Se la connessione e' caduta solleva :class:`StorageUnavailable`: la riconnessione
+        non avviene qui (bloccherebbe :func:`mqtt_loop()`) ma con :func:`storage_offline()`.
+        """
+        if not self.conn.is_connected():
+            raise StorageUnavailable("connessione al database persa")
+
+    def close(self):
+        """Chiude cursore e connessione se la connessione e' attiva."""
+        if self.conn.is_connected():
+            super().close()
+
+    def executemany(self, t_query, t_rows):
+        """
+        Esegue l'istruzione SQL <t_query> per ogni elemento di <t_rows>.
+
+        Usa un cursore senza prepared statements: in questo modo
+        mysql-connector invia le INSERT come un'unica istruzione con piu' righe.
+
+        :param str t_query: istruzione SQL con segnaposto ``%s``
+        :param list t_rows: lista di liste/tuple con i parametri
+        """
+        bulk_cursor = self.conn.cursor()
+        try:
+            bulk_cursor.executemany(t_query, t_rows)
+        finally:
+            bulk_cursor.close()
+
+    def execute_ddl(self, t_query):
+        """
+        Esegue l'istruzione DDL <t_query> con un cursore senza prepared statements.
+
+        :param str t_query: istruzione SQL (ALTER TABLE, ...)
+        """
+        logger("Esecuzione istruzione: {}".format(t_query), logfile)
+        ddl_cursor = self.conn.cursor()
+        try:
+            ddl_cursor.execute(t_query)
+        finally:
+            ddl_cursor.close()
+
+    def get_partitions(self, t_table):
+        """
+        Restituisce nome e limite superiore delle partizioni della tabella <t_table>.
+
+        :param str t_table: nome della tabella
+        :return partitions: lista di tuple (nome, limite) in ordine, limite e' None per MAXVALUE;
+                            lista vuota se la tabella non e' partizionata
+        :rtype: list
+        """
+        query = ("SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+                 "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY PARTITION_ORDINAL_POSITION")
+        self.execute(query, [t_table])
+
+        partitions = []
+        for name, description in self.cursor.fetchall():
+            if name is None:
+                continue
+            name = name.decode() if isinstance(name, (bytes, bytearray)) else name
+            description = description.decode() if isinstance(description, (bytes, bytearray)) else description
+            partitions.append((name, None if description == "MAXVALUE" else int(description)))
+
+        return partitions
+
+    def apply_retention(self, t_table, t_settings, t_time):
+        """
+        Gestisce le partizioni per intervallo di tempo (RANGE su tstamp) della tabella <t_table>.
+
+        Crea in anticipo le partizioni dei prossimi <partition_ahead> periodi dividendo
+        la partizione vuota p_future (VALUES LESS THAN MAXVALUE) ed elimina
+        con DROP PARTITION quelle scadute: a differenza di una DELETE
+        l'eliminazione e' immediata e le insert lavorano su una partizione piccola.
+
+        Se la tabella non e' partizionata e <partition_convert> e' True la tabella viene convertita
+        (la chiave primaria diventa (id, tstamp) come richiesto da MySQL),
+        altrimenti viene scritto un avviso nel log.
+
+        :param str t_table: nome della tabella dei dati
+        :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+        :param int t_time: timestamp attuale
+        """
+        interval = t_settings.partition_period
+        periods = partition_periods(interval, t_time, t_settings.partition_ahead + 1)
+        partitions = self.get_partitions(t_table)
+
+        # tabella non partizionata
+        if not partitions:
+            if not t_settings.partition_convert:
+                logger("WARNING: la tabella '{}' non e' partizionata, impostare convert = true "
+                       "nella sezione 'Partitioning' per convertirla".format(t_table), logfile)
+                return
+
+            definitions = ["PARTITION {} VALUES LESS THAN ({})".format(name, bound) for name, bound in periods]
+            self.execute_ddl("ALTER TABLE {} DROP PRIMARY KEY, ADD PRIMARY KEY (id, tstamp)".format(t_table))
+            self.execute_ddl("ALTER TABLE {} PARTITION BY RANGE (tstamp) ({}, "
+                             "PARTITION p_future VALUES LESS THAN MAXVALUE)".format(t_table, ", ".join(definitions)))
+            return
+
+        # crea le partizioni future mancanti
+        names = [name for name, bound in partitions]
+        last_bound = max([bound for name, bound in partitions if bound is not None] or [0])
+        missing = [(name, bound) for name, bound in periods if name not in names and bound > last_bound]
+
+        if missing:
+            definitions = ["PARTITION {} VALUES LESS THAN ({})".format(name, bound) for name, bound in missing]
+            if "p_future" in names:
+                self.execute_ddl("ALTER TABLE {} REORGANIZE PARTITION p_future INTO ({}, "
+                                 "PARTITION p_future VALUES LESS THAN MAXVALUE)".format(
+                                     t_table, ", ".join(definitions)))
+            else:
+                self.execute_ddl("ALTER TABLE {} ADD PARTITION ({})".format(t_table, ", ".join(definitions)))
+
+        # elimina le partizioni scadute (tutti i dati precedenti al periodo piu' vecchio da conservare)
+        if t_settings.partition_retention > 0:
+            cutoff = period_start(interval, t_time, 1 - t_settings.partition_retention)
+            expired = [name for name, bound in partitions if bound is not None and bound <= cutoff]
+
+            # MySQL non permette di eliminare tutte le partizioni
+            if expired and len(expired) < len(partitions):
+                self.execute_ddl("ALTER TABLE {} DROP PARTITION {}".format(t_table, ", ".join(expired)))
+
+
+class SQLiteStorage(Storage):
+    """
+    Database SQLite in un file locale, per le installazioni su un solo raspberry pi.
+
+    Il database usa il journal WAL (le letture non bloccano le scritture
+    e i commit non riscrivono il file del database) con synchronous=NORMAL.
+    Le tabelle vengono create se non esistono e il tipo 0 (DHT22)
+    viene aggiunto alla tabella t_types.
+
+    :param str t_path: percorso del file del database
+    """
+
+    # tabelle create all'apertura del database
+    schema = ["CREATE TABLE IF NOT EXISTS t_types (id INTEGER PRIMARY KEY, description TEXT, category_id INTEGER)",
+              "CREATE TABLE IF NOT EXISTS t_nodi (id INTEGER PRIMARY KEY AUTOINCREMENT, ip TEXT, type_id INTEGER, "
+              "mac TEXT, location_id INTEGER)",
+              "CREATE INDEX IF NOT EXISTS i_nodi_mac ON t_nodi (mac)",
+              "CREATE TABLE IF NOT EXISTS t_type0_data (id INTEGER PRIMARY KEY AUTOINCREMENT, tstamp INTEGER, "
+              "node_id INTEGER, temp REAL, hum REAL, rssi INTEGER)",
+              "CREATE INDEX IF NOT EXISTS i_type0_data_tstamp ON t_type0_data (tstamp)",
+              "CREATE TABLE IF NOT EXISTS t_type0_options (node_id INTEGER PRIMARY KEY, timebetweenread INTEGER)",
+              "INSERT OR IGNORE INTO t_types (id, description, category_id) VALUES (0, 'DHT22: temp, hum', 0)"]
+
+    def __init__(self, t_path):
+        # la connessione puo' essere creata da storage_reconnect() e usata dal thread principale
+        t_conn = sqlite3.connect(t_path, check_same_thread=False)
+        t_conn.execute("PRAGMA journal_mode=WAL")
+        t_conn.execute("PRAGMA synchronous=NORMAL")
+
+        for query in self.schema:
+            t_conn.execute(query)
+        t_conn.commit()
+
+        super().__init__(t_conn, t_conn.cursor())
+
+    def execute(self, t_query, t_params):
+        self.cursor.execute(t_query.replace("%s", "?"), t_params)
+
+    def executemany(self, t_query, t_rows):
+        self.cursor.executemany(t_query.replace("%s", "?"), t_rows)
+
+
+class OfflineStorage(Storage):
+    """
+    Database non raggiungibile, usato finche' :func:`storage_reconnect()` non si connette.
+
+    Ogni operazione solleva :class:`StorageUnavailable`: i dati vengono
+    salvati nello spool e nodi, tipi e impostazioni vengono letti dallo snapshot.
+    """
+
+    def __init__(self):
+        super().__init__(None, None)
+
+    def execute(self, t_query, t_params):
+        raise StorageUnavailable("database non raggiungibile")
+
+    def executemany(self, t_query, t_rows):
+        raise StorageUnavailable("database non raggiungibile")
+
+    def commit(self):
+        raise StorageUnavailable("database non raggiungibile")
+
+    def rollback(self):
+        pass
+
+    def check(self):
+        raise StorageUnavailable("database non raggiungibile")
+
+    def close(self):
+        pass
+
+
 ##################################################################################################################
 #                                                                                                                #
 #                                                 UTILS FUNCTIONS                                                #
@@ -576,45 +1663,51 @@ def valid_mac(t_mac):
 ####################
 
 
-def mysql_conn(t_configfile):
+def storage_conn(t_settings):
     """
-    Si connette al database e restituisce oggetto connessione.
+    Si connette al database scelto nella configurazione e restituisce oggetto database.
 
-    Si assicura che il file di configurazione esiste e contiene le proprieta'
-    necessarie a connettersi al DB.
+    La sezione facoltativa 'Storage' contiene il backend da usare:
 
-    :param str t_configfile: stringa, percorso del file con credenziali per mysql
-    :return mydb: oggetto connessione
+    - ``backend = mysql`` (default): :class:`MySQLStorage`, connessione con :func:`mysql_conn()`
+    - ``backend = sqlite``: :class:`SQLiteStorage`, database nel file ``path``
+
+    :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+    :return t_storage: oggetto database
+    :rtype: Storage
     """
 
-    if not os.path.isfile(t_configfile):
-        raise Exception("Il file di configurazione '{}' non esiste".format(t_configfile))
+    if t_settings.storage_backend == "mysql":
+        if mysql is None:
+            raise Exception("Il backend 'mysql' richiede la libreria mysql-connector")
+        t_storage = MySQLStorage(mysql_conn(t_settings))
 
-    config = configparser.ConfigParser()
-    config.read(t_configfile)
+    else:
+        t_storage = SQLiteStorage(t_settings.storage_path)
 
-    # assicurati presenza delle sezioni nella configurazione
-    if "Database" not in config:
-        raise Exception("Sezione 'Database' non presente nel file configurazione")
+    return t_storage
 
-    # assicurati che username, password, host e database di MySQL siano presenti nella configurazione
-    if "username" not in config["Database"]:
-        raise Exception("'username' non presente nella sezione 'Database' della configurazione")
 
-    if "password" not in config["Database"]:
-        raise Exception("'password' non presente nella sezione 'Database' della configurazione")
+def mysql_conn(t_settings):
+    """
+    Si connette al database e restituisce oggetto connessione.
 
-    if "host" not in config["Database"]:
-        raise Exception("'host' non presente nella sezione 'Database' della configurazione")
+    Le proprieta' necessarie a connettersi al DB (sezione 'Database')
+    sono gia' state controllate da :meth:`Settings.load()`.
+    La proprieta' facoltativa timeout (secondi, default 10) limita l'attesa della connessione
+    e delle risposte del server: un database non raggiungibile non blocca :func:`mqtt_loop()`
+    oltre il keepalive del broker.
 
-    if "database" not in config["Database"]:
-        raise Exception("'database' non presente nella sezione 'Database' della configurazione")
+    :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+    :return mydb: oggetto connessione
+    """
 
     mydb = mysql.connector.connect(
-        host=config["Database"]["host"],
-        user=config["Database"]["username"],
-        passwd=config["Database"]["password"],
-        database=config["Database"]["database"]
+        host=t_settings.db_host,
+        user=t_settings.db_username,
+        passwd=t_settings.db_password,
+        database=t_settings.db_database,
+        connection_timeout=t_settings.db_timeout
     )
 
     return mydb
@@ -624,31 +1717,28 @@ def get_node(t_macaddr):
     """
     Restituisce id, ip, type_id del nodo con indirizzo MAC <t_macaddr>.
 
-    La funzione esegue un'istruzione SQL di select per selezionare
+    La funzione seleziona con :meth:`Storage.get_node()`
     id, ip, type_id del nodo dalla tabella t_nodi dove (WHERE) mac corrisponde a <t_macaddr>.
 
+    Il risultato viene memorizzato in <node_cache> per <settings.cache_ttl> secondi:
+    se il database non e' raggiungibile viene restituito quello memorizzato (anche se scaduto).
+
     :param string t_macaddr: stringa con indirizzo MAC
     :return node: tupla con informazioni relative al nodo
     :rtype: tuple
     """
     logger("Ottengo informazioni sul node '{}'".format(t_macaddr), logfile)
 
-    # seleziona id, ip, type_id dalla tabella t_nodi dove mac = <t_macaddr>
-    query = "SELECT t_nodi.id, t_nodi.ip, t_nodi.type_id FROM t_nodi WHERE t_nodi.mac = %s"
-    cursor.execute(query, [t_macaddr])
-
-    # recupera dati dall'esecuzione dell'istruzione SQL
-    node = cursor.fetchall()
-
-    return node
+    return cache_get(node_cache, t_macaddr, storage.get_node)
 
 
 def get_type(t_typeid):
     """
     Restituisce id, description, category_id del nodo con type_id = <t_typeid>.
 
-    La funzione esegue un'istruzione SQL di select per selezionare
-    id, description, category_id dalla tabella t_types dove (WHERE) id = <t_typeid>
+    La funzione seleziona con :meth:`Storage.get_type()`
+    id, description, category_id dalla tabella t_types dove (WHERE) id = <t_typeid>,
+    il risultato viene memorizzato in <type_cache> come in :func:`get_node()`.
 
     :param int t_typeid: intero, identifica tipo di nodo
     :return nodetype: tupla, contiene id, description, category_id del tipo di nodo <t_typeid>
@@ -656,59 +1746,432 @@ def get_type(t_typeid):
     """
     logger("Ottengo informazioni sul tipo dei node '{}'".format(t_typeid), logfile)
 
-    # seleziona id, description, category_id dalla tabella t_types dove id = <t_typeid>
-    query = "SELECT t_types.id, t_types.description, t_types.category_id FROM t_types WHERE t_types.id = %s"
-    cursor.execute(query, [t_typeid])
+    return cache_get(type_cache, t_typeid, storage.get_type)
 
-    # recupera dati dall'esecuzione dell'istruzione SQL
-    nodetype = cursor.fetchall()
 
-    return nodetype
+def storage_reconnect(t_settings):
+    """
+    Prova a connettersi al database finche' non ci riesce (eseguita in un thread).
+
+    Tra i tentativi l'attesa raddoppia fino a 60 secondi. A connessione avvenuta
+    il database viene messo in <storage_queue>: :func:`mqtt_loop()` lo sostituisce
+    a :class:`OfflineStorage` con :func:`storage_switch()` nel thread principale.
+    Il thread non scrive nel log: anche gli errori di connessione vengono messi
+    in <storage_queue> (se e' libera) e scritti nel log da :func:`mqtt_loop()`.
+
+    :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+    """
+    delay = 1
+
+    while True:
+        try:
+            storage_queue.put(storage_conn(t_settings))
+            return
+
+        except storage_errors as t_e:
+            try:
+                storage_queue.put_nowait(t_e)
+            except queue.Full:
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+def storage_offline():
+    """
+    Sostituisce il database non raggiungibile con :class:`OfflineStorage`.
+
+    Viene richiamata nel thread principale quando un'operazione fallisce per un errore
+    di connessione (<storage_unavailable_errors>): la connessione viene chiusa e la riconnessione
+    avviene in un thread con :func:`storage_reconnect()`, senza bloccare :func:`mqtt_loop()`.
+    Se il database e' gia' :class:`OfflineStorage` non fa niente.
+    """
+    global storage
+
+    if isinstance(storage, OfflineStorage):
+        return
+
+    logger("WARNING: connessione al database persa, nuovo tentativo in background", logfile)
+    try:
+        storage.close()
+    except storage_errors:
+        pass
+
+    storage = OfflineStorage()
+    threading.Thread(target=storage_reconnect, args=(settings,), daemon=True).start()
+
+
+def storage_switch(t_storage):
+    """
+    Sostituisce il database non raggiungibile con <t_storage>.
+
+    Aggiorna nodi e tipi in memoria con :func:`storage_reconcile()`
+    e reinserisce i dati dello spool con :func:`spool_replay()`.
+
+    :param t_storage: oggetto database connesso
+    """
+    global storage
+
+    storage = t_storage
+    logger("Connesso al database", logfile)
+
+    storage_reconcile()
+    spool_replay()
+
+
+def storage_reconcile():
+    """
+    Sostituisce nodi e tipi in memoria (ex. caricati dallo snapshot) con quelli del database.
+    """
+    global snapshot_dirty
+
+    try:
+        nodes = {}
+        for mac, node_id, ip, type_id in storage.get_nodes():
+            nodes.setdefault(mac, []).append((node_id, ip, type_id))
+
+        types = {}
+        for nodetype in storage.get_types():
+            types.setdefault(nodetype[0], []).append(tuple(nodetype))
+
+        now = time.time()
+        node_cache.clear()
+        node_cache.update({mac: (now, node) for mac, node in nodes.items()})
+        type_cache.clear()
+        type_cache.update({type_id: (now, nodetype) for type_id, nodetype in types.items()})
+        snapshot_dirty = True
+
+        logger("Informazioni in memoria aggiornate dal database: {} nodi, {} tipi".format(len(nodes), len(types)),
+               logfile)
+
+    except Exception as t_e:
+        logger("ERROR: storage_reconcile(), errore sconosciuto sulla riga '{}': {}".format(
+            sys.exc_info()[2].tb_lineno, t_e), logfile)
 
 
 ####################
 #
-# MQTT FUNCTIONS
+# CACHE FUNCTIONS
 #
 ####################
 
 
-def mqtt_conn(t_configfile):
+def cache_get(t_cache, t_key, t_function):
     """
-    Si connette al broker MQTT e restituisce oggetto connessione.
+    Restituisce il valore di <t_key> in <t_cache> o lo ottiene dal database con <t_function>.
 
-    Si assicura che il file di configurazione esiste e contiene le proprieta'
-    necessarie a connettersi al broker MQTT.
+    Il valore memorizzato viene usato se e' stato caricato da meno di <settings.cache_ttl>
+    secondi o se il database non e' raggiungibile: in questo caso, se il valore
+    non e' memorizzato, l'errore viene propagato al chiamante.
 
-    :param str t_configfile: stringa, percorso del file con credenziali per mysql
-    :return t_client: oggetto client
+    :param dict t_cache: dizionario chiave -> (timestamp caricamento, valore)
+    :param t_key: chiave (ex. indirizzo MAC)
+    :param t_function: funzione che restituisce il valore dal database
+    :return value: valore di <t_key>
+    """
+    cached = t_cache.get(t_key)
+    if cached is not None and time.time() - cached[0] < settings.cache_ttl:
+        return cached[1]
+
+    try:
+        value = t_function(t_key)
+    except storage_errors:
+        if cached is None:
+            raise
+        return cached[1]
+
+    cache_set(t_cache, t_key, value)
+
+    return value
+
+
+def cache_set(t_cache, t_key, t_value):
+    """
+    Memorizza <t_value> in <t_cache> e segnala lo snapshot da salvare se e' cambiato.
+
+    :param dict t_cache: dizionario chiave -> (timestamp caricamento, valore)
+    :param t_key: chiave
+    :param t_value: valore da memorizzare
+    """
+    global snapshot_dirty
+
+    cached = t_cache.get(t_key)
+    if cached is None or cached[1] != t_value:
+        snapshot_dirty = True
+
+    t_cache[t_key] = (time.time(), t_value)
+
+
+####################
+#
+# SNAPSHOT FUNCTIONS
+#
+####################
+
+
+def snapshot_write():
+    """
+    Salva nel file <snapshot_path> nodi, tipi e impostazioni in memoria.
+
+    Il file (formato pickle binario) viene scritto in un file temporaneo
+    e poi rinominato, cosi' uno snapshot interrotto non sostituisce quello precedente.
+    """
+    global snapshot_dirty
+
+    try:
+        snapshot = {"version": snapshot_version,
+                    "tstamp": int(time.time()),
+                    "nodes": {mac: value for mac, (loaded, value) in node_cache.items()},
+                    "types": {type_id: value for type_id, (loaded, value) in type_cache.items()},
+                    "options": {node_id: value for node_id, (loaded, value) in options_cache.items()}}
+
+        with open(snapshot_path + ".tmp", "wb") as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+        snapshot_dirty = False
+
+    except Exception as t_e:
+        logger("ERROR: snapshot_write(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                        t_e),
+               logfile)
+
+
+def snapshot_load():
+    """
+    Carica in memoria nodi, tipi e impostazioni dal file <snapshot_path>.
+
+    Le informazioni caricate sono considerate scadute: vengono usate
+    solo finche' il database non e' raggiungibile (vedi :func:`cache_get()`).
+    """
+    if not os.path.isfile(snapshot_path):
+        return
+
+    start = time.perf_counter()
+
+    try:
+        with open(snapshot_path, "rb") as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+
+        if snapshot.get("version") != snapshot_version:
+            logger("WARNING: versione dello snapshot '{}' non supportata".format(snapshot.get("version")), logfile)
+            return
+
+        node_cache.update({mac: (0, value) for mac, value in snapshot["nodes"].items()})
+        type_cache.update({type_id: (0, value) for type_id, value in snapshot["types"].items()})
+        options_cache.update({node_id: (0, value) for node_id, value in snapshot["options"].items()})
+
+        logger("Snapshot del {} caricato in {:.1f} ms: {} nodi, {} tipi".format(
+            snapshot["tstamp"], (time.perf_counter() - start) * 1000, len(node_cache), len(type_cache)), logfile)
+
+    except Exception as t_e:
+        logger("ERROR: snapshot_load(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                       t_e),
+               logfile)
+
+
+####################
+#
+# SPOOL FUNCTIONS
+#
+####################
+
+
+def spool_write(t_macaddr, t_msg, t_timestamp, t_validated=False):
+    """
+    Salva nello spool i dati che non e' stato possibile inserire nel database.
+
+    Aggiunge al file <spool_path> una riga JSON con indirizzo MAC,
+    timestamp di ricezione, messaggio e se i dati sono gia' stati validati
+    e si assicura che sia scritta su disco prima di restituire il controllo.
+
+    :param str t_macaddr: stringa, indirizzo MAC
+    :param dict t_msg: messaggio MQTT decodificato
+    :param int t_timestamp: timestamp di ricezione dei dati
+    :param bool t_validated: True = dati gia' validati da :func:`validate_type0()`
+    """
+    with open(spool_path, "a") as spool_file:
+        spool_file.write(json.dumps({"mac": t_macaddr, "tstamp": t_timestamp, "msg": t_msg,
+                                     "validated": t_validated}) + "\n")
+        spool_file.flush()
+        os.fsync(spool_file.fileno())
+
+
+def spool_replay():
+    """
+    Reinserisce nel database i dati salvati nello spool.
+
+    Lo spool viene rinominato in "<spool_path>.replay" (i nuovi dati
+    vengono salvati in un nuovo spool), i dati vengono inseriti
+    con :func:`insert_data()` mantenendo il timestamp di ricezione
+    (senza validarli di nuovo se erano gia' stati validati) e confermati con un unico commit:
+    se il database non e' raggiungibile le modifiche vengono annullate e il file viene mantenuto
+    per il prossimo tentativo, cosi' nessun dato viene perso o inserito due volte.
+
+    Le righe rifiutate dal database per un errore che si ripeterebbe a ogni tentativo
+    (non in <storage_unavailable_errors>) vengono spostate in "<spool_path>.rejected"
+    e non bloccano il reinserimento delle altre.
+    """
+    replay_path = spool_path + ".replay"
+    rejected = []
+
+    # riprendi un replay interrotto o prepara quello dello spool attuale
+    if not os.path.isfile(replay_path):
+        if not os.path.isfile(spool_path):
+            return
+        os.replace(spool_path, replay_path)
+
+    try:
+        storage.check()
+
+        count = 0
+        with open(replay_path) as replay_file:
+            for line in replay_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger("WARNING: riga dello spool non valida: '{}'".format(line.strip()), logfile)
+                    continue
+
+                try:
+                    insert_data(record["mac"], record["msg"], record["tstamp"], not record.get("validated", False))
+                    count += 1
+
+                # database non raggiungibile: gestito sotto, il replay viene ritentato
+                except storage_unavailable_errors:
+                    raise
+
+                # dati rifiutati dal database: la riga viene messa da parte
+                except storage_errors as t_e:
+                    logger_limited("WARNING: spool_replay(), riga rifiutata dal database: '{}'".format(t_e), logfile,
+                                   "spool_replay rejected")
+                    rejected.append(line)
+
+        storage.commit()
+
+        if rejected:
+            with open(spool_path + ".rejected", "a") as rejected_file:
+                rejected_file.writelines(rejected)
+                rejected_file.flush()
+                os.fsync(rejected_file.fileno())
+
+        os.remove(replay_path)
+        logger("Spool reinserito nel database: {} messaggi, {} rifiutati".format(count, len(rejected)), logfile)
+
+    except storage_errors as t_e:
+        logger_limited("WARNING: spool_replay(), database non raggiungibile: '{}'".format(t_e), logfile,
+                       "spool_replay")
+        try:
+            storage.rollback()
+        except storage_errors:
+            pass
+
+        if isinstance(t_e, storage_unavailable_errors):
+            storage_offline()
+
+    except Exception as t_e:
+        logger("ERROR: spool_replay(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                      t_e),
+               logfile)
+
+
+####################
+#
+# PARTITION FUNCTIONS
+#
+####################
+
+
+def period_start(t_interval, t_time, t_offset=0):
+    """
+    Restituisce il timestamp di inizio del periodo (giorno o mese, UTC).
+
+    Il periodo e' quello che contiene <t_time> spostato di <t_offset> periodi
+    (ex. -1 = periodo precedente, 1 = periodo successivo).
+
+    :param str t_interval: "day" o "month"
+    :param int t_time: timestamp
+    :param int t_offset: numero di periodi da aggiungere
+    :return start: timestamp di inizio del periodo
+    :rtype: int
+    """
+    date = time.gmtime(t_time)
+
+    if t_interval == "day":
+        return calendar.timegm((date.tm_year, date.tm_mon, date.tm_mday, 0, 0, 0)) + t_offset * 86400
+
+    month = date.tm_year * 12 + date.tm_mon - 1 + t_offset
+    return calendar.timegm((month // 12, month % 12 + 1, 1, 0, 0, 0))
+
+
+def partition_periods(t_interval, t_time, t_count):
     """
+    Restituisce nome e limite delle partizioni di <t_count> periodi a partire da quello attuale.
+
+    Il nome e' nel formato pAAAAMMGG (giorni) o pAAAAMM (mesi),
+    il limite e' il timestamp di inizio del periodo successivo (VALUES LESS THAN).
 
-    if not os.path.isfile(t_configfile):
-        raise Exception("Il file di configurazione '{}' non esiste".format(t_configfile))
+    :param str t_interval: "day" o "month"
+    :param int t_time: timestamp attuale
+    :param int t_count: numero di periodi
+    :return periods: lista di tuple (nome, limite)
+    :rtype: list
+    """
+    name_format = "p%Y%m%d" if t_interval == "day" else "p%Y%m"
 
-    config = configparser.ConfigParser()  # crea oggetto config
-    config.read(t_configfile)             # leggi il file di configurazione
+    return [(time.strftime(name_format, time.gmtime(period_start(t_interval, t_time, i))),
+             period_start(t_interval, t_time, i + 1))
+            for i in range(t_count)]
 
-    # assicurati presenza delle sezioni nella configurazione
-    if "MQTT broker" not in config:
-        raise Exception("Sezione 'MQTT broker' non presente nel file configurazione")
 
-    # assicurati che username, password, host e port del broker MQTT siano presenti nella configurazione
-    if "username" not in config["MQTT broker"]:
-        raise Exception("'username' non presente nella sezione 'MQTT broker' della configurazione")
+def manage_partitions():
+    """
+    Crea le partizioni future ed elimina i dati scaduti delle tabelle dei dati.
 
-    if "password" not in config["MQTT broker"]:
-        raise Exception("'password' non presente nella sezione 'MQTT broker' della configurazione")
+    Richiama :meth:`Storage.apply_retention()` per ogni tabella in <settings.partition_tables>,
+    non fa nulla se la sezione 'Partitioning' non e' configurata.
+    """
+    if "Partitioning" not in settings.sections:
+        return
 
-    if "host" not in config["MQTT broker"]:
-        raise Exception("'host' non presente nella sezione 'MQTT broker' della configurazione")
+    for table in settings.partition_tables:
+        try:
+            storage.apply_retention(table, settings, int(time.time()))
 
-    if "port" not in config["MQTT broker"]:
-        raise Exception("'port' non presente nella sezione 'MQTT broker' della configurazione")
+        except Exception as t_e:
+            logger("ERROR: manage_partitions(), errore sulla tabella '{}' alla riga '{}': {}".format(
+                table, sys.exc_info()[2].tb_lineno, t_e), logfile)
 
-    # prepara il client alla connessione al broker MQTT (identificativo "mqtt_manager", sessione pulita)
-    t_client = mqtt.Client(client_id="mqtt_manager", clean_session=True)
+
+####################
+#
+# MQTT FUNCTIONS
+#
+####################
+
+
+def mqtt_conn(t_settings):
+    """
+    Si connette al broker MQTT e restituisce oggetto connessione.
+
+    Le proprieta' necessarie a connettersi al broker MQTT (sezione 'MQTT broker')
+    sono gia' state controllate da :meth:`Settings.load()`, le proprieta'
+    facoltative qos, clean_session, min_delay e max_delay hanno un valore di default.
+
+    Se il broker non e' raggiungibile il client viene restituito comunque:
+    la connessione verra' ritentata da :func:`mqtt_loop()`.
+
+    :param Settings t_settings: impostazioni lette da :meth:`Settings.load()`
+    :return t_client: oggetto client
+    """
+    global reconnect_delay
+
+    reconnect_delay = t_settings.mqtt_min_delay
+
+    # prepara il client alla connessione al broker MQTT
+    # (identificativo "mqtt_manager", di default sessione persistente,
+    # i messaggi vengono confermati da on_message() solo dopo averli salvati)
+    t_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="mqtt_manager",
+                           clean_session=t_settings.mqtt_clean_session, manual_ack=True)
 
     # aggiungi callback per eventi
     t_client.on_connect = on_connect        # richiama on_connect() quando il client mqtt si connette
@@ -716,19 +2179,424 @@ def mqtt_conn(t_configfile):
     t_client.on_disconnect = on_disconnect  # richiama quando si disconnette il client
 
     # imposta username e password per connessione
-    t_client.username_pw_set(username=config["MQTT broker"]["username"],
-                             password=config["MQTT broker"]["password"])
+    t_client.username_pw_set(username=t_settings.mqtt_username,
+                             password=t_settings.mqtt_password)
 
     logger("Connessione al broker MQTT", logfile)
 
     # connettiti al broker mqtt con dominio/ip <host> e porta <port>
-    t_client.connect(config["MQTT broker"]["host"],
-                     int(config["MQTT broker"]["port"]),
-                     60)
+    try:
+        t_client.connect(t_settings.mqtt_host,
+                         t_settings.mqtt_port,
+                         60)
+    except OSError as t_e:
+        logger("WARNING: broker MQTT non raggiungibile, nuovo tentativo in corso: '{}'".format(t_e), logfile)
 
     return t_client
 
 
+def mqtt_loop(t_client):
+    """
+    Mantiene la connessione con il broker MQTT e gestisce i messaggi.
+
+    Sostituisce loop_forever() del client: se la connessione cade
+    aspetta un tempo casuale tra 0 e <reconnect_delay> secondi e si riconnette.
+    A ogni tentativo fallito l'attesa massima raddoppia fino a max_delay
+    (backoff esponenziale con jitter, i client non si riconnettono tutti insieme),
+    a connessione avvenuta :func:`on_connect()` la riporta a min_delay.
+
+    Ogni <settings.spool_interval> secondi richiama :func:`spool_replay()`
+    per reinserire nel database i dati salvati nello spool,
+    ogni <settings.partition_interval> secondi :func:`manage_partitions()`,
+    ogni <settings.snapshot_interval> secondi :func:`snapshot_write()` (se ci sono modifiche) e
+    ogni <settings.log_interval> secondi :func:`validation_summary()` e :func:`logger_summary()`.
+    Se :func:`storage_reconnect()` si e' connesso al database lo usa con :func:`storage_switch()`
+    e dopo un segnale SIGHUP rilegge le impostazioni con :func:`settings_reload()`,
+    dopo SIGUSR1 o SIGALRM avvia o termina il profiling con :func:`profiling_check()`.
+
+    :param t_client: client MQTT
+    """
+    global reconnect_delay
+
+    last_replay = 0
+    last_partition = 0
+    last_snapshot = time.time()
+
+    while True:
+        rc = t_client.loop(timeout=1.0)
+
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            wait = random.uniform(0, reconnect_delay)
+            logger("WARNING: connessione al broker MQTT assente (codice {}), "
+                   "nuovo tentativo tra {:.1f} secondi".format(rc, wait), logfile)
+            time.sleep(wait)
+            reconnect_delay = min(reconnect_delay * 2, settings.mqtt_max_delay)
+
+            try:
+                t_client.reconnect()
+            except OSError as t_e:
+                logger("WARNING: riconnessione al broker MQTT fallita: '{}'".format(t_e), logfile)
+
+        # SIGHUP ricevuto: aggiorna le impostazioni senza chiudere le connessioni
+        if reload_requested:
+            settings_reload()
+
+        # SIGUSR1 o SIGALRM ricevuto: avvia o termina il profiling
+        if profiling_requested or profiling_expired:
+            profiling_check()
+
+        # database connesso in background: sostituisci quello non raggiungibile
+        if not storage_queue.empty():
+            result = storage_queue.get()
+            if isinstance(result, Exception):
+                logger_limited("WARNING: database non raggiungibile, nuovo tentativo: '{}'".format(result), logfile,
+                               "storage_reconnect")
+            else:
+                storage_switch(result)
+
+        # reinserisci nel database i dati dello spool
+        if time.time() - last_replay >= settings.spool_interval:
+            last_replay = time.time()
+            spool_replay()
+
+        # crea le partizioni future ed elimina i dati scaduti
+        if time.time() - last_partition >= settings.partition_interval:
+            last_partition = time.time()
+            manage_partitions()
+
+        # salva lo snapshot di nodi, tipi e impostazioni
+        if snapshot_dirty and time.time() - last_snapshot >= settings.snapshot_interval:
+            last_snapshot = time.time()
+            snapshot_write()
+
+        # scrivi il riepilogo delle letture scartate e dei messaggi di log ripetuti
+        if time.time() - log_interval_start >= settings.log_interval:
+            validation_summary()
+            logger_summary(logfile)
+
+
+####################
+#
+# SETTINGS FUNCTIONS
+#
+####################
+
+
+def settings_apply():
+    """
+    Aggiorna le strutture in memoria che dipendono dalle impostazioni.
+
+    Ricalcola <validation_config> con :func:`validation_conf()` e ridimensiona
+    <recent_messages> a <settings.dedup_size> messaggi (mantenendo gli ultimi ricevuti).
+    """
+    global validation_config, recent_messages
+
+    validation_config = validation_conf(settings)
+
+    if recent_messages.maxlen != settings.dedup_size:
+        recent_messages = collections.deque(recent_messages, maxlen=settings.dedup_size)
+
+
+def settings_signal(t_signum, t_frame):
+    """
+    Richiede la rilettura delle impostazioni alla ricezione del segnale SIGHUP.
+
+    Le impostazioni vengono rilette da :func:`mqtt_loop()` con :func:`settings_reload()`
+    e non durante la gestione di un messaggio.
+
+    :param int t_signum: numero del segnale ricevuto
+    :param t_frame: frame in esecuzione alla ricezione del segnale
+    """
+    global reload_requested
+
+    reload_requested = True
+
+
+def settings_reload():
+    """
+    Rilegge il file di configurazione e aggiorna le impostazioni ricaricabili.
+
+    Con :meth:`Settings.update()` vengono aggiornate solo le sezioni 'Performance', 'Log'
+    e 'Validation': le connessioni al broker e al database restano attive,
+    le altre proprieta' modificate vengono segnalate nel log e richiedono il riavvio.
+    Se la nuova configurazione non e' valida restano attive le impostazioni precedenti.
+    """
+    global reload_requested
+
+    reload_requested = False
+
+    try:
+        ignored = settings.update(Settings.load(configfile_path))
+        settings_apply()
+
+    except Exception as t_e:
+        logger("ERROR: impostazioni non ricaricate, restano attive le precedenti: '{}'".format(t_e), logfile)
+        return
+
+    logger("Impostazioni ricaricate da '{}'".format(configfile_path), logfile)
+
+    if ignored:
+        logger("WARNING: proprieta' modificate che richiedono il riavvio: {}".format(", ".join(ignored)), logfile)
+
+
+####################
+#
+# PROFILING FUNCTIONS
+#
+####################
+
+
+def manage_profiling(t_msg):
+    """
+    Gestisce i messaggi del topic di amministrazione del profiling.
+
+    Il messaggio JSON contiene l'azione da eseguire:
+
+    - ``{"action": "start", "seconds": 30, "sample": 0.1}``: avvia il profiling
+      (seconds e sample sono facoltativi)
+    - ``{"action": "stop"}``: termina il profiling e salva i risultati
+
+    :param dict t_msg: messaggio MQTT decodificato
+    """
+    try:
+        action = t_msg["action"]
+
+        if action == "start":
+            profiling_start(t_msg.get("seconds", settings.profiling_seconds),
+                            t_msg.get("sample", settings.profiling_sample))
+        elif action == "stop":
+            profiling_stop()
+        else:
+            logger("WARNING: azione di profiling '{}' sconosciuta".format(action), logfile)
+
+    except Exception as t_e:
+        logger("ERROR: manage_profiling(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                          t_e),
+               logfile)
+
+
+def profiling_signal(t_signum, t_frame):
+    """
+    Richiede l'attivazione o la disattivazione del profiling alla ricezione del segnale SIGUSR1.
+
+    Il profiling viene avviato o terminato da :func:`profiling_check()` in :func:`mqtt_loop()`
+    e non durante la gestione di un messaggio (ex. mentre :func:`logger()` scrive nel file di log).
+
+    :param int t_signum: numero del segnale ricevuto
+    :param t_frame: frame in esecuzione alla ricezione del segnale
+    """
+    global profiling_requested
+
+    profiling_requested = True
+
+
+def profiling_alarm(t_signum, t_frame):
+    """
+    Richiede la fine del profiling allo scadere del tempo (segnale SIGALRM).
+
+    :param int t_signum: numero del segnale ricevuto
+    :param t_frame: frame in esecuzione alla ricezione del segnale
+    """
+    global profiling_expired
+
+    profiling_expired = True
+
+
+def profiling_check():
+    """
+    Avvia o termina il profiling richiesto dai segnali SIGUSR1 e SIGALRM.
+
+    Con SIGUSR1 se il profiling e' disattivato viene avviato con durata e campionamento
+    di default, altrimenti viene terminato e i risultati vengono salvati.
+    Con SIGALRM viene terminata la sessione attiva se il suo tempo e' scaduto.
+    """
+    global profiling_requested, profiling_expired
+
+    if profiling_expired:
+        profiling_expired = False
+        if profiling is not None and time.time() >= profiling["deadline"]:
+            profiling_stop()
+
+    if profiling_requested:
+        profiling_requested = False
+        if profiling is None:
+            profiling_start(settings.profiling_seconds, settings.profiling_sample)
+        else:
+            profiling_stop()
+
+
+def profiling_wrap(t_session, t_name, t_function, t_root=False):
+    """
+    Restituisce la funzione <t_function> che misura i propri tempi di esecuzione.
+
+    Se il messaggio in elaborazione e' campionato, ogni chiamata aggiunge
+    agli span della sessione nome, profondita', inizio e durata in millisecondi.
+    La funzione radice (<t_root> = True, on_message()) decide se campionare
+    il messaggio e a fine elaborazione scrive gli span nel file delle tracce.
+
+    :param dict t_session: sessione di profiling
+    :param str t_name: nome della funzione
+    :param t_function: funzione originale
+    :param bool t_root: True se la funzione e' la radice della traccia
+    :return wrapper: funzione che misura i tempi
+    """
+    @functools.wraps(t_function)
+    def wrapper(*args, **kwargs):
+        if t_root and t_session["spans"] is None and random.random() < t_session["sample"]:
+            t_session["spans"] = []
+            t_session["start"] = time.perf_counter()
+
+        spans = t_session["spans"]
+        if spans is None:
+            return t_function(*args, **kwargs)
+
+        depth = t_session["depth"]
+        t_session["depth"] = depth + 1
+        start = time.perf_counter()
+        try:
+            return t_function(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            t_session["depth"] = depth
+            spans.append({"name": t_name,
+                          "depth": depth,
+                          "start_ms": round((start - t_session["start"]) * 1000, 3),
+                          "duration_ms": round((end - start) * 1000, 3)})
+
+            if t_root:
+                # scrivi la traccia del messaggio e preparati al prossimo
+                topic = getattr(args[2], "topic", None) if len(args) > 2 else None
+                if not t_session["trace_file"].closed:
+                    t_session["trace_file"].write(json.dumps({"tstamp": int(time.time()),
+                                                              "topic": topic,
+                                                              "spans": spans}) + "\n")
+                t_session["spans"] = None
+
+                # termina il profiling se il tempo e' scaduto
+                if profiling is t_session and time.time() >= t_session["deadline"]:
+                    profiling_stop()
+
+    return wrapper
+
+
+def profiling_start(t_seconds, t_sample):
+    """
+    Avvia una sessione di profiling di <t_seconds> secondi.
+
+    Attiva cProfile e tracemalloc e sostituisce le funzioni in
+    <profiling_functions> con la versione che misura i tempi (:func:`profiling_wrap()`),
+    tracciando una frazione <t_sample> dei messaggi.
+    Quando il profiling e' disattivato le funzioni originali
+    vengono ripristinate, quindi non c'e' alcun costo aggiuntivo.
+
+    :param int t_seconds: durata della sessione in secondi
+    :param float t_sample: frazione (0-1) dei messaggi da tracciare
+    """
+    global profiling
+
+    if profiling is not None:
+        logger("WARNING: profiling gia' attivo", logfile)
+        return
+
+    t_seconds = int(t_seconds)
+    os.makedirs(settings.profiling_directory, exist_ok=True)
+    prefix = os.path.join(settings.profiling_directory, time.strftime("%Y%m%d_%H%M%S"))
+
+    session = {"prefix": prefix,
+               "deadline": time.time() + t_seconds,
+               "sample": float(t_sample),
+               "spans": None,
+               "depth": 0,
+               "start": 0.0,
+               "trace_file": open(prefix + "_trace.jsonl", "a"),
+               "originals": {},
+               "profiler": cProfile.Profile()}
+
+    # sostituisci le funzioni con la versione che misura i tempi
+    module = globals()
+    for name in profiling_functions:
+        session["originals"][name] = module[name]
+        module[name] = profiling_wrap(session, name, module[name], t_root=(name == "on_message"))
+    profiling_rebind()
+
+    profiling = session
+    logger("Profiling avviato per {} secondi (campionamento {}): '{}'".format(t_seconds, t_sample, prefix), logfile)
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    session["profiler"].enable()
+
+    # termina il profiling allo scadere del tempo anche se non arrivano messaggi
+    if hasattr(signal, "SIGALRM"):
+        signal.alarm(t_seconds)
+
+
+def profiling_stop():
+    """
+    Termina la sessione di profiling e salva i risultati.
+
+    Ripristina le funzioni originali e scrive nella cartella del profiling:
+
+    - ``<prefisso>.prof``: statistiche di cProfile (leggibili con pstats/snakeviz)
+    - ``<prefisso>_trace.jsonl``: span dei messaggi campionati, uno per riga
+    - ``<prefisso>_malloc.snapshot`` e ``<prefisso>_malloc.txt``: snapshot di tracemalloc
+      e righe che allocano piu' memoria
+    """
+    global profiling
+
+    session = profiling
+    if session is None:
+        return
+
+    session["profiler"].disable()
+    profiling = None
+
+    if hasattr(signal, "SIGALRM"):
+        signal.alarm(0)
+
+    # ripristina le funzioni originali
+    globals().update(session["originals"])
+    profiling_rebind()
+
+    try:
+        session["profiler"].dump_stats(session["prefix"] + ".prof")
+        session["trace_file"].close()
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(session["prefix"] + "_malloc.snapshot")
+            with open(session["prefix"] + "_malloc.txt", "w") as malloc_file:
+                for stat in snapshot.statistics("lineno")[:25]:
+                    malloc_file.write(str(stat) + "\n")
+
+        logger("Profiling terminato, risultati salvati in '{}'".format(session["prefix"]), logfile)
+
+    except Exception as t_e:
+        logger("ERROR: profiling_stop(), errore sconosciuto sulla riga '{}': {}".format(sys.exc_info()[2].tb_lineno,
+                                                                                        t_e),
+               logfile)
+
+
+def profiling_rebind():
+    """
+    Aggiorna i riferimenti alle funzioni salvati fuori dal modulo.
+
+    Il client MQTT e la lista <maintopics> mantengono un riferimento
+    diretto alle funzioni: vengono aggiornati con quelle attuali del modulo
+    (originali o con misura dei tempi).
+    """
+    module = globals()
+
+    for maintopic in module.get("maintopics", []):
+        name = maintopic["function"].__name__
+        if name in profiling_functions:
+            maintopic["function"] = module[name]
+
+    if client is not None:
+        client.on_message = module["on_message"]
+
+
 ####################
 #
 # LOG FUNCTIONS
@@ -748,14 +2616,22 @@ def logger(t_message, t_logfile):
     significa che non si puo' attendere la chiusura del file
     per salvare i messaggi di log (andrebbero persi).
 
+    I messaggi con livello (in base al prefisso: informativi, "WARNING" o "ERROR")
+    inferiore a <settings.log_level> non vengono scritti.
+
     :param string t_message: stringa, contiene messaggio di log da scrivere
     :param t_logfile: file di log (aperto) da scrivere
     """
+    # scarta i messaggi sotto il livello configurato (ex. con "warning" quelli di ogni messaggio MQTT)
+    level = 2 if t_message.startswith("ERROR") else 1 if t_message.startswith("WARNING") else 0
+    if level < Settings.log_levels[settings.log_level]:
+        return
+
     # ottieni timestamp
     ts = int(time.time())
 
-    # visualizza messaggio se boold = True
-    if boold:
+    # visualizza messaggio se <settings.log_debug> = True
+    if settings.log_debug:
         print("[{}] {}".format(ts, t_message))
 
     # scrivi il file subito
@@ -763,10 +2639,62 @@ def logger(t_message, t_logfile):
     t_logfile.flush()
 
 
-if __name__ == "__main__":
+def logger_limited(t_message, t_logfile, t_key=None):
+    """
+    Scrive nel file di log <t_logfile> la riga <t_message> una sola volta per intervallo.
+
+    Da usare per i messaggi che possono ripetersi a ogni messaggio MQTT
+    (ex. un nodo che invia dati non validi): la prima occorrenza della chiave <t_key>
+    (di default il messaggio stesso) in un intervallo di <settings.log_interval> secondi
+    viene scritta con :func:`logger()`, le successive vengono solo contate
+    e riassunte da :func:`logger_summary()` a fine intervallo.
+
+    :param string t_message: stringa, contiene messaggio di log da scrivere
+    :param t_logfile: file di log (aperto) da scrivere
+    :param string t_key: stringa, identifica i messaggi ripetuti (None = <t_message>)
+    """
+    key = t_message if t_key is None else t_key
+
+    # intervallo terminato: scrivi il riepilogo e ricomincia
+    if time.time() - log_interval_start >= settings.log_interval:
+        logger_summary(t_logfile)
+
+    if key in log_repeated:
+        log_repeated[key] += 1
+    elif len(log_repeated) < settings.log_max_keys:
+        log_repeated[key] = 0
+        logger(t_message, t_logfile)
+    else:
+        # troppi messaggi diversi: conta senza scrivere
+        log_repeated["<altri messaggi>"] = log_repeated.get("<altri messaggi>", 0) + 1
+
+
+def logger_summary(t_logfile):
+    """
+    Scrive nel file di log il riepilogo dei messaggi ripetuti e inizia un nuovo intervallo.
+
+    Viene scritta una sola riga con il numero di ripetizioni soppresse
+    da :func:`logger_limited()` per ogni chiave (al massimo 20 chiavi, le piu' frequenti).
+
+    :param t_logfile: file di log (aperto) da scrivere
+    """
+    global log_interval_start
+
+    now = time.time()
+    suppressed = sorted([(count, key) for key, count in log_repeated.items() if count > 0], reverse=True)
+
+    if suppressed:
+        summary = "; ".join("'{}' x{}".format(key, count) for count, key in suppressed[:20])
+        if len(suppressed) > 20:
+            summary += "; altri {} messaggi".format(len(suppressed) - 20)
+        logger("WARNING: messaggi ripetuti soppressi negli ultimi {} secondi: {}".format(
+            int(now - log_interval_start), summary), t_logfile)
 
-    if boold:
-        print("Start")
+    log_repeated.clear()
+    log_interval_start = now
+
+
+if __name__ == "__main__":
 
     # maintopic riconosciuti dal sistema
     maintopics = [{"name": "presentation", "function": manage_presentation},  # gestisce presentazione nodi
@@ -776,28 +2704,57 @@ if __name__ == "__main__":
     logfile = open("log.txt", "a")
 
     try:
+        # leggi e valida una sola volta tutte le impostazioni
+        settings = Settings.load(configfile_path)
+        settings_apply()
+
+        if settings.log_debug:
+            print("Start")
+
+        # profiling attivabile con SIGUSR1 o con il topic di amministrazione,
+        # impostazioni ricaricabili con SIGHUP
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, profiling_signal)
+            signal.signal(signal.SIGALRM, profiling_alarm)
+            signal.signal(signal.SIGHUP, settings_signal)
+
+        # carica nodi, tipi e impostazioni salvati all'ultima esecuzione
+        snapshot_load()
+
         logger("Connessione al database", logfile)
-        
-        # connettiti al database e richiedi cursore con prepared statements
-        conn = mysql_conn(configfile_path)
-        cursor = conn.cursor(prepared=True)
+
+        # connettiti al database scelto nella configurazione, se non e' raggiungibile
+        # gestisci i messaggi con lo snapshot e lo spool e riprova in background
+        try:
+            storage = storage_conn(settings)
+            storage_reconcile()
+        except storage_errors as e:
+            logger("WARNING: database non raggiungibile, avvio con lo snapshot: '{}'".format(e), logfile)
+            storage = OfflineStorage()
+            threading.Thread(target=storage_reconnect, args=(settings,), daemon=True).start()
 
         # connettiti al broker MQTT e mantieni la connessione
-        client = mqtt_conn(configfile_path)
-        client.loop_forever()
+        client = mqtt_conn(settings)
+        mqtt_loop(client)
 
-    except mysql.connector.Error as e:
-        # errore di mysql
-        logger("ERROR: errore mysql sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno, e), logfile)
+    except storage_errors as e:
+        # errore del database
+        logger("ERROR: errore database sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno, e), logfile)
 
     except Exception as e:
         # errore non previsto
         logger("ERROR: errore sconosciuto sulla riga '{}': '{}'".format(sys.exc_info()[2].tb_lineno, e), logfile)
     finally:
+        # salva i risultati di un eventuale profiling in corso
+        profiling_stop()
+
+        # salva lo snapshot per il prossimo avvio
+        if snapshot_dirty:
+            snapshot_write()
+
         # a termine del try/except (in teoria mai) disconnettiti dal DB
-        if conn is not None and conn.is_connected():
-            cursor.close()
-            conn.close()
+        if storage is not None:
+            storage.close()
             logger("Connessione al DB chiusa", logfile)
 
     # chiudi file di log
@@ -0,0 +1,42 @@
+import collections
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
+
+import mqtt_manager  # noqa: E402
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """mqtt_manager con impostazioni di default, log in memoria e file nella cartella temporanea."""
+    monkeypatch.setattr(mqtt_manager, "settings", mqtt_manager.Settings())
+    monkeypatch.setattr(mqtt_manager, "logfile", io.StringIO(), raising=False)
+    monkeypatch.setattr(mqtt_manager, "log_repeated", {})
+    monkeypatch.setattr(mqtt_manager, "log_interval_start", 0)
+    monkeypatch.setattr(mqtt_manager, "validation_config", None)
+    monkeypatch.setattr(mqtt_manager, "validation_history", {})
+    monkeypatch.setattr(mqtt_manager, "validation_outliers", {})
+    monkeypatch.setattr(mqtt_manager, "validation_stats", dict.fromkeys(mqtt_manager.validation_reasons, 0))
+    monkeypatch.setattr(mqtt_manager, "validation_logged", dict.fromkeys(mqtt_manager.validation_reasons, 0))
+    monkeypatch.setattr(mqtt_manager, "quarantine_path", str(tmp_path / "quarantine.jsonl"))
+    monkeypatch.setattr(mqtt_manager, "spool_path", str(tmp_path / "spool.jsonl"))
+    monkeypatch.setattr(mqtt_manager, "node_cache", {})
+    monkeypatch.setattr(mqtt_manager, "type_cache", {})
+    monkeypatch.setattr(mqtt_manager, "options_cache", {})
+    monkeypatch.setattr(mqtt_manager, "snapshot_dirty", False)
+    monkeypatch.setattr(mqtt_manager, "recent_messages", collections.deque(maxlen=1000))
+    monkeypatch.setattr(mqtt_manager, "storage", None)
+    return mqtt_manager
+
+
+@pytest.fixture
+def validation(manager):
+    """mqtt_manager con la validazione dei dati attivata (impostazioni di default)."""
+    pytest.importorskip("numpy")
+    manager.settings.sections.add("Validation")
+    manager.validation_config = manager.validation_conf(manager.settings)
+    return manager
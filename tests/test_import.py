@@ -0,0 +1,53 @@
+import mqtt_import
+
+
+def parse(t_lines):
+    stats = {"lines": 0, "invalid": 0, "skipped": 0}
+    return list(mqtt_import.parse_records(iter(t_lines), stats)), stats
+
+
+def test_mosquitto_sub_timestamps(manager):
+    records, stats = parse(['1470818943.786368637 data/aa:bb:cc:dd:ee:ff {"temperature": 20.5}',
+                            '1470818944 data/aa:bb:cc:dd:ee:ff {"temperature": 20.6}',
+                            'data/aa:bb:cc:dd:ee:ff {"temperature": 20.7}'])
+
+    assert records[0] == ("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.5}, 1470818943)
+    assert records[1] == ("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.6}, 1470818944)
+    assert records[2][:2] == ("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.7})
+    assert stats["invalid"] == 0
+
+
+def test_json_and_spool_lines(manager):
+    records, stats = parse(['{"mac": "aa:bb:cc:dd:ee:ff", "tstamp": 1000, "msg": {"temperature": 20.5}, '
+                            '"validated": true}',
+                            '{"topic": "data/aa:bb:cc:dd:ee:ff", "payload": "{\\"temperature\\": 20.6}", '
+                            '"tstamp": 1060}',
+                            'data/aa:bb:cc:dd:ee:ff not json',
+                            '1470818943.5 data/aa:bb:cc:dd:ee:ff [1, 2]'])
+
+    assert records == [("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.5}, 1000),
+                       ("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.6}, 1060)]
+    assert stats == {"lines": 4, "invalid": 2, "skipped": 0}
+
+
+def test_invalid_timestamp_is_counted(manager):
+    records, stats = parse(['{"topic": "data/aa:bb:cc:dd:ee:ff", "payload": {"temperature": 20.5}, '
+                            '"tstamp": "2020-01-01 10:00"}',
+                            '{"mac": "aa:bb:cc:dd:ee:ff", "tstamp": 1000, "msg": {"temperature": 20.6}}'])
+
+    assert records == [("data/aa:bb:cc:dd:ee:ff", {"temperature": 20.6}, 1000)]
+    assert stats == {"lines": 2, "invalid": 1, "skipped": 0}
+
+
+def test_rejected_batch_does_not_stop_import(manager, tmp_path):
+    database = manager.SQLiteStorage(str(tmp_path / "data.db"))
+    bulk = mqtt_import.BulkStorage(database, 3)
+
+    # il blocco con la riga non valida viene inserito una riga alla volta, il successivo normalmente
+    bulk.add_type0_data([(1000, 1, 20.0, 40.0, -60), (1060, 1, [1], 40.0, -60), (1120, 1, 20.1, 40.0, -60)])
+    bulk.add_type0_data([(1180, 1, 20.2, 40.0, -60)])
+    bulk.flush()
+
+    assert database.conn.execute("SELECT tstamp FROM t_type0_data").fetchall() == [(1000,), (1120,), (1180,)]
+    assert (bulk.count, bulk.failed) == (3, 1)
+    database.close()
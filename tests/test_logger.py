@@ -0,0 +1,24 @@
+def error_lines(t_manager):
+    return [line for line in t_manager.logfile.getvalue().splitlines() if "ERROR" in line]
+
+
+def test_malformed_data_logged_once_per_node(manager):
+    for i in range(5):
+        manager.manage_data_type0(1, {"humidity": 40.0, "rssi": -60}, 1000 + i)
+    manager.manage_data_type0(2, {"humidity": 40.0, "rssi": -60}, 1000)
+
+    lines = error_lines(manager)
+    assert len(lines) == 2
+    assert "nodo '1'" in lines[0] and "nodo '2'" in lines[1]
+    assert manager.log_repeated["manage_data_type0 1"] == 4
+
+
+def test_summary_reports_suppressed_messages(manager):
+    for i in range(3):
+        manager.logger_limited("WARNING: avviso", manager.logfile)
+
+    manager.logger_summary(manager.logfile)
+
+    assert manager.logfile.getvalue().count("WARNING: avviso") == 2  # avviso e riepilogo
+    assert "'WARNING: avviso' x2" in manager.logfile.getvalue()
+    assert manager.log_repeated == {}
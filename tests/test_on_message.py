@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+MAC = "aa:bb:cc:dd:ee:ff"
+
+
+class Message:
+    """Messaggio MQTT ricevuto (come paho.mqtt.client.MQTTMessage)."""
+
+    def __init__(self, t_mid, t_payload, t_dup=False):
+        self.topic = "data/" + MAC
+        self.mid = t_mid
+        self.qos = 1
+        self.payload = json.dumps(t_payload).encode()
+        self.dup = t_dup
+
+
+class Client:
+    """Client MQTT creato con manual_ack: registra i messaggi confermati."""
+
+    def __init__(self):
+        self.acked = []
+
+    def ack(self, t_mid, t_qos):
+        self.acked.append(t_mid)
+
+
+@pytest.fixture
+def received(manager, monkeypatch):
+    messages = []
+    monkeypatch.setattr(manager, "maintopics",
+                        [{"name": "data", "function": lambda mac, msg: messages.append(msg)}], raising=False)
+    return messages
+
+
+def test_redelivered_message_is_ignored(manager, received):
+    reading = {"temperature": 20.0, "humidity": 40.0, "rssi": -60}
+
+    client = Client()
+
+    manager.on_message(client, None, Message(1, reading))
+    manager.on_message(client, None, Message(1, reading, t_dup=True))
+
+    assert received == [reading]
+    assert client.acked == [1, 1]
+
+
+def test_identical_reading_redelivered_is_processed(manager, received):
+    reading = {"temperature": 20.0, "humidity": 40.0, "rssi": -60}
+
+    # lettura identica alla precedente, reinviata dal broker prima di essere elaborata
+    client = Client()
+
+    manager.on_message(client, None, Message(1, reading))
+    manager.on_message(client, None, Message(2, reading, t_dup=True))
+
+    assert received == [reading, reading]
+    assert client.acked == [1, 2]
+
+
+def test_message_not_saved_is_not_acked(manager, monkeypatch):
+    reading = {"temperature": 20.0, "humidity": 40.0, "rssi": -60}
+    client = Client()
+    results = [False, None]
+    messages = []
+
+    def manage(t_macaddr, t_msg):
+        messages.append(t_msg)
+        return results.pop(0)
+
+    monkeypatch.setattr(manager, "maintopics", [{"name": "data", "function": manage}], raising=False)
+
+    # dati non salvati: nessuna conferma, il reinvio del broker viene elaborato
+    manager.on_message(client, None, Message(1, reading))
+    assert client.acked == []
+
+    manager.on_message(client, None, Message(1, reading, t_dup=True))
+    assert messages == [reading, reading]
+    assert client.acked == [1]
+
+
+def test_invalid_message_is_acked(manager, received):
+    client = Client()
+    message = Message(1, {})
+    message.payload = b"{non json"
+
+    manager.on_message(client, None, message)
+
+    assert received == [] and client.acked == [1]
@@ -0,0 +1,131 @@
+import calendar
+
+import pytest
+
+import mqtt_manager
+
+
+def utc(*t_date):
+    """Timestamp della data UTC (anno, mese, giorno[, ora])."""
+    return calendar.timegm(tuple(t_date) + (0,) * (6 - len(t_date)))
+
+
+NOW = utc(2024, 3, 15, 12)
+
+
+class FakeMySQLStorage(mqtt_manager.MySQLStorage):
+    """MySQLStorage senza connessione: partizioni esistenti fisse e DDL registrate."""
+
+    def __init__(self, t_partitions):
+        self.partitions = t_partitions
+        self.ddl = []
+
+    def get_partitions(self, t_table):
+        return self.partitions
+
+    def execute_ddl(self, t_query):
+        self.ddl.append(t_query)
+
+
+def partitioning(**t_values):
+    settings = mqtt_manager.Settings()
+    for key, value in t_values.items():
+        setattr(settings, "partition_" + key, value)
+    return settings
+
+
+@pytest.mark.parametrize("interval, offset, expected", [
+    ("day", 0, utc(2024, 3, 15)),
+    ("day", 1, utc(2024, 3, 16)),
+    ("day", -15, utc(2024, 2, 29)),
+    ("month", 0, utc(2024, 3, 1)),
+    ("month", -3, utc(2023, 12, 1)),
+    ("month", 10, utc(2025, 1, 1)),
+])
+def test_period_start(interval, offset, expected):
+    assert mqtt_manager.period_start(interval, NOW, offset) == expected
+
+
+def test_partition_periods():
+    assert mqtt_manager.partition_periods("day", NOW, 2) == [("p20240315", utc(2024, 3, 16)),
+                                                             ("p20240316", utc(2024, 3, 17))]
+    assert mqtt_manager.partition_periods("month", utc(2024, 12, 31, 23), 2) == [
+        ("p202412", utc(2025, 1, 1)), ("p202501", utc(2025, 2, 1))]
+
+
+def test_unpartitioned_table_without_convert(manager):
+    storage = FakeMySQLStorage([])
+
+    storage.apply_retention("t_type0_data", partitioning(convert=False), NOW)
+
+    assert storage.ddl == []
+    assert "non e' partizionata" in manager.logfile.getvalue()
+
+
+def test_convert_unpartitioned_table(manager):
+    storage = FakeMySQLStorage([])
+
+    storage.apply_retention("t_type0_data", partitioning(convert=True, ahead=1), NOW)
+
+    assert storage.ddl == [
+        "ALTER TABLE t_type0_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, tstamp)",
+        "ALTER TABLE t_type0_data PARTITION BY RANGE (tstamp) ("
+        "PARTITION p20240315 VALUES LESS THAN ({}), PARTITION p20240316 VALUES LESS THAN ({}), "
+        "PARTITION p_future VALUES LESS THAN MAXVALUE)".format(utc(2024, 3, 16), utc(2024, 3, 17))]
+
+
+def test_create_future_partitions_and_drop_expired(manager):
+    storage = FakeMySQLStorage([("p20240313", utc(2024, 3, 14)),
+                                ("p20240314", utc(2024, 3, 15)),
+                                ("p20240315", utc(2024, 3, 16)),
+                                ("p_future", None)])
+
+    storage.apply_retention("t_type0_data", partitioning(ahead=2, retention=2), NOW)
+
+    assert storage.ddl == [
+        "ALTER TABLE t_type0_data REORGANIZE PARTITION p_future INTO ("
+        "PARTITION p20240316 VALUES LESS THAN ({}), PARTITION p20240317 VALUES LESS THAN ({}), "
+        "PARTITION p_future VALUES LESS THAN MAXVALUE)".format(utc(2024, 3, 17), utc(2024, 3, 18)),
+        "ALTER TABLE t_type0_data DROP PARTITION p20240313"]
+
+
+def test_add_partitions_without_future_partition(manager):
+    storage = FakeMySQLStorage([("p202403", utc(2024, 4, 1))])
+
+    storage.apply_retention("t_data", partitioning(period="month", ahead=1), NOW)
+
+    assert storage.ddl == ["ALTER TABLE t_data ADD PARTITION (PARTITION p202404 VALUES LESS THAN ({}))".format(
+        utc(2024, 5, 1))]
+
+
+def test_up_to_date_partitions(manager):
+    storage = FakeMySQLStorage([("p20240315", utc(2024, 3, 16)),
+                                ("p20240316", utc(2024, 3, 17)),
+                                ("p_future", None)])
+
+    storage.apply_retention("t_type0_data", partitioning(ahead=1, retention=0), NOW)
+
+    assert storage.ddl == []
+
+
+def test_never_drop_every_partition(manager):
+    storage = FakeMySQLStorage([("p20240301", utc(2024, 3, 2))])
+
+    storage.apply_retention("t_type0_data", partitioning(ahead=0, retention=1), NOW)
+
+    assert storage.ddl == ["ALTER TABLE t_type0_data ADD PARTITION (PARTITION p20240315 VALUES LESS THAN ({}))".format(
+        utc(2024, 3, 16))]
+
+
+def test_sqlite_retention_deletes_expired_rows(manager, tmp_path):
+    storage = mqtt_manager.SQLiteStorage(str(tmp_path / "data.db"))
+    storage.add_type0_data([(utc(2024, 3, 13, 23), 1, 20.0, 40.0, -60),
+                            (utc(2024, 3, 14), 1, 20.0, 40.0, -60),
+                            (NOW, 1, 20.0, 40.0, -60)])
+    storage.commit()
+
+    storage.apply_retention("t_type0_data", partitioning(retention=2), NOW)
+
+    assert storage.conn.execute("SELECT tstamp FROM t_type0_data ORDER BY tstamp").fetchall() == [
+        (utc(2024, 3, 14),), (NOW,)]
+    storage.close()
@@ -0,0 +1,30 @@
+import os
+
+
+def test_signals_only_request_profiling(manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(manager, "profiling", None)
+    monkeypatch.setattr(manager, "profiling_requested", False)
+    monkeypatch.setattr(manager, "profiling_expired", False)
+    monkeypatch.setattr(manager.signal, "alarm", lambda seconds: 0)
+    manager.settings.profiling_directory = str(tmp_path / "profiling")
+    original = manager.on_message
+
+    # il gestore del segnale non modifica il modulo: il profiling parte in profiling_check()
+    manager.profiling_signal(manager.signal.SIGUSR1, None)
+    assert manager.profiling is None and manager.on_message is original
+
+    manager.profiling_check()
+    session = manager.profiling
+    assert session is not None and manager.on_message is not original
+    assert not manager.profiling_requested
+
+    # SIGALRM prima della scadenza (ex. di una sessione precedente): la sessione continua
+    manager.profiling_alarm(manager.signal.SIGALRM, None)
+    manager.profiling_check()
+    assert manager.profiling is session
+
+    session["deadline"] = 0
+    manager.profiling_alarm(manager.signal.SIGALRM, None)
+    manager.profiling_check()
+    assert manager.profiling is None and manager.on_message is original
+    assert os.path.isfile(session["prefix"] + ".prof")
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+import pytest
+
+
+def test_reconnect_thread_does_not_log(manager, monkeypatch):
+    attempts = []
+    connected = object()
+
+    def storage_conn(t_settings):
+        attempts.append(t_settings)
+        if len(attempts) < 3:
+            raise manager.StorageUnavailable("database non raggiungibile")
+        return connected
+
+    monkeypatch.setattr(manager, "storage_queue", queue.Queue(maxsize=1))
+    monkeypatch.setattr(manager, "storage_conn", storage_conn)
+    monkeypatch.setattr(manager.time, "sleep", lambda seconds: None)
+
+    thread = threading.Thread(target=manager.storage_reconnect, args=(manager.settings,), daemon=True)
+    thread.start()
+
+    results = []
+    while not results or isinstance(results[-1], Exception):
+        results.append(manager.storage_queue.get(timeout=5))
+    thread.join(timeout=5)
+
+    # gli errori arrivano al thread principale, che li scrive nel log
+    assert results[-1] is connected
+    assert all(isinstance(result, manager.StorageUnavailable) for result in results[:-1])
+    assert manager.logfile.getvalue() == ""
+    assert manager.log_repeated == {}
+
+
+class Connection:
+    """Connessione MySQL caduta: registra i tentativi di riconnessione."""
+
+    def __init__(self):
+        self.reconnected = False
+
+    def cursor(self, prepared=False):
+        return None
+
+    def is_connected(self):
+        return False
+
+    def reconnect(self, attempts=1, delay=0):
+        self.reconnected = True
+
+
+def test_mysql_check_does_not_reconnect(manager):
+    conn = Connection()
+    database = manager.MySQLStorage(conn)
+
+    # la riconnessione avviene in background con storage_offline(), non nel thread principale
+    with pytest.raises(manager.StorageUnavailable):
+        database.check()
+
+    assert not conn.reconnected
+
+
+def test_runtime_outage_reconnects_in_background(manager, monkeypatch):
+    started = []
+
+    class Thread:
+        def __init__(self, target, args, daemon):
+            self.target = target
+
+        def start(self):
+            started.append(self.target)
+
+    class LostStorage(manager.Storage):
+        closed = False
+
+        def __init__(self):
+            super().__init__(None, None)
+
+        def execute(self, t_query, t_params):
+            raise manager.sqlite3.OperationalError("disk I/O error")
+
+        def close(self):
+            LostStorage.closed = True
+
+    monkeypatch.setattr(manager.threading, "Thread", Thread)
+    monkeypatch.setattr(manager, "storage", LostStorage())  # connessione caduta durante il funzionamento
+
+    assert manager.manage_data("aa:bb:cc:dd:ee:ff", {"temperature": 20.0, "humidity": 40.0, "rssi": -60}) is None
+
+    # i dati sono nello spool e la riconnessione parte una sola volta
+    assert type(manager.storage) is manager.OfflineStorage and LostStorage.closed
+    assert started == [manager.storage_reconnect]
+    assert len(open(manager.spool_path).readlines()) == 1
+
+    manager.manage_data("aa:bb:cc:dd:ee:ff", {"temperature": 20.0, "humidity": 40.0, "rssi": -60})
+    assert started == [manager.storage_reconnect]
@@ -0,0 +1,70 @@
+import pytest
+
+import mqtt_manager
+
+CONFIG = """
+[Storage]
+backend = SQLite
+path = data.db
+
+[MQTT broker]
+username = user
+password = secret
+host = broker
+port = 1883
+
+[Log]
+level = warning
+"""
+
+
+@pytest.fixture
+def configfile(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(CONFIG)
+    return path
+
+
+def test_load_typed_values(configfile):
+    settings = mqtt_manager.Settings.load(str(configfile))
+
+    assert settings.storage_backend == "sqlite"
+    assert settings.mqtt_port == 1883
+    assert settings.log_level == "warning"
+    assert settings.cache_ttl == 300.0
+    assert "Validation" not in settings.sections
+
+
+def test_environment_overrides(configfile, monkeypatch):
+    monkeypatch.setenv("MQTT_MANAGER_MQTT_BROKER_PORT", "8883")
+    monkeypatch.setenv("MQTT_MANAGER_PERFORMANCE_CACHE_TTL", "10")
+
+    settings = mqtt_manager.Settings.load(str(configfile))
+
+    assert settings.mqtt_port == 8883
+    assert settings.cache_ttl == 10.0
+    assert "Performance" in settings.sections
+
+
+@pytest.mark.parametrize("old, new, error", [
+    ("port = 1883", "port = abc", "'port' della sezione 'MQTT broker' non valido"),
+    ("port = 1883", "", "'port' non presente nella sezione 'MQTT broker'"),
+    ("backend = SQLite", "backend = mysql", "Sezione 'Database' non presente"),
+    ("level = warning", "level = loud", "'level' della sezione 'Log'"),
+])
+def test_invalid_configuration(configfile, old, new, error):
+    configfile.write_text(CONFIG.replace(old, new))
+
+    with pytest.raises(Exception, match=error):
+        mqtt_manager.Settings.load(str(configfile))
+
+
+def test_update_only_reloadable_sections(configfile):
+    settings = mqtt_manager.Settings.load(str(configfile))
+    configfile.write_text(CONFIG.replace("host = broker", "host = other").replace("level = warning", "level = error"))
+
+    ignored = settings.update(mqtt_manager.Settings.load(str(configfile)))
+
+    assert settings.log_level == "error"
+    assert settings.mqtt_host == "broker"
+    assert ignored == ["MQTT broker.host"]
@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+
+MAC = "aa:bb:cc:dd:ee:ff"
+
+
+@pytest.fixture
+def node(validation, tmp_path, monkeypatch):
+    """Nodo di tipo 0 in un database SQLite, orologio controllato dal test."""
+    clock = [1000]
+    monkeypatch.setattr(validation.time, "time", lambda: clock[0])
+
+    database = validation.SQLiteStorage(str(tmp_path / "data.db"))
+    database.execute("INSERT INTO t_nodi (ip, type_id, mac, location_id) VALUES (%s, %s, %s, %s)",
+                     ["192.168.1.2", 0, MAC, 0])
+    database.commit()
+    validation.storage = database
+
+    yield clock, database
+    database.close()
+
+
+def send(manager, clock, temp):
+    clock[0] += 60
+    manager.manage_data(MAC, {"temperature": temp, "humidity": 40.0, "rssi": -60})
+
+
+def test_replay_does_not_validate_again(node):
+    import mqtt_manager as manager
+    clock, database = node
+
+    for i in range(12):
+        send(manager, clock, 20.0 + (i % 3) * 0.1)
+
+    # database non raggiungibile: le letture vengono salvate nello spool
+    manager.storage = manager.OfflineStorage()
+    for i in range(6):
+        send(manager, clock, 20.0 + (i % 3) * 0.1)
+    send(manager, clock, 35.0)  # scartata dallo z-score: non viene salvata nello spool
+
+    spooled = [json.loads(line) for line in open(manager.spool_path)]
+    assert len(spooled) == 6
+    assert all(record["validated"] for record in spooled)
+
+    manager.storage = database
+    manager.spool_replay()
+
+    assert database.conn.execute("SELECT COUNT(*) FROM t_type0_data").fetchone()[0] == 18
+    assert manager.validation_stats["valid"] == 18
+    assert manager.validation_stats["zscore"] == 1
+    assert not os.path.exists(manager.spool_path + ".replay")
+
+
+def test_replay_validates_unvalidated_records(node):
+    import mqtt_manager as manager
+    clock, database = node
+
+    # spool senza il campo "validated" (ex. scritto prima della validazione): i dati vengono validati
+    with open(manager.spool_path, "w") as spool_file:
+        for tstamp, temp in [(1060, 20.0), (1120, "nan")]:
+            spool_file.write(json.dumps({"mac": MAC, "tstamp": tstamp,
+                                         "msg": {"temperature": temp, "humidity": 40.0, "rssi": -60}}) + "\n")
+
+    manager.spool_replay()
+
+    assert database.conn.execute("SELECT tstamp FROM t_type0_data").fetchall() == [(1060,)]
+    assert manager.validation_stats["nan"] == 1
+
+
+def test_spool_write_failure_is_reported(node, tmp_path):
+    import mqtt_manager as manager
+    clock, database = node
+
+    # database e spool non disponibili: i dati non sono salvati, il messaggio non va confermato
+    manager.storage = manager.OfflineStorage()
+    manager.spool_path = str(tmp_path / "missing" / "spool.jsonl")
+
+    clock[0] += 60
+    assert manager.manage_data(MAC, {"temperature": 20.0, "humidity": 40.0, "rssi": -60}) is False
+
+
+def test_rejected_data_is_not_spooled(node):
+    import mqtt_manager as manager
+    clock, database = node
+    manager.validation_config = None  # senza validazione il valore arriva al database
+
+    # tipo non valido: il database rifiuta i dati, salvarli nello spool non servirebbe
+    clock[0] += 60
+    manager.manage_data(MAC, {"temperature": [1], "humidity": 40.0, "rssi": -60})
+
+    assert not os.path.exists(manager.spool_path)
+
+
+def test_replay_skips_rejected_records(node):
+    import mqtt_manager as manager
+    clock, database = node
+
+    with open(manager.spool_path, "w") as spool_file:
+        for tstamp, temp in [(1060, 20.0), (1120, [1]), (1180, 20.1)]:
+            spool_file.write(json.dumps({"mac": MAC, "tstamp": tstamp, "validated": True,
+                                         "msg": {"temperature": temp, "humidity": 40.0, "rssi": -60}}) + "\n")
+
+    manager.spool_replay()
+
+    assert database.conn.execute("SELECT tstamp FROM t_type0_data").fetchall() == [(1060,), (1180,)]
+    assert not os.path.exists(manager.spool_path + ".replay")
+    rejected = [json.loads(line) for line in open(manager.spool_path + ".rejected")]
+    assert [record["tstamp"] for record in rejected] == [1120]
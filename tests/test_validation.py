@@ -0,0 +1,119 @@
+import json
+
+
+def steady(node_id, count, start=1000, step=60, temp=20.0):
+    """Letture regolari di un nodo (temperatura stabile con piccole variazioni)."""
+    return [(start + i * step, node_id, temp + (i % 3) * 0.1, 40.0, -60) for i in range(count)]
+
+
+def test_spike_does_not_reject_next_reading(validation):
+    for row in steady(1, 15):
+        assert validation.validate_type0([row]) == [row]
+
+    spike = (1900, 1, 35.0, 40.0, -60)
+    following = (1960, 1, 20.1, 40.0, -60)
+
+    assert validation.validate_type0([spike]) == []
+    assert validation.validate_type0([following]) == [following]
+    assert validation.validation_history[1][-1] == (1960, 20.1, 40.0)
+
+
+def test_spike_in_batch_does_not_reject_next_reading(validation):
+    rows = steady(1, 15) + [(1900, 1, 35.0, 40.0, -60), (1960, 1, 20.1, 40.0, -60)]
+
+    assert validation.validate_type0(rows) == rows[:15] + rows[16:]
+    assert validation.validation_stats["valid"] == 16
+
+
+def test_rate_checked_against_last_accepted_reading(validation):
+    rows = [(1000, 1, 20.0, 40.0, -60),
+            (1010, 1, 25.0, 40.0, -60),  # +0.5 gradi/s rispetto alla lettura precedente
+            (1020, 1, 20.5, 40.0, -60)]  # +0.025 gradi/s rispetto all'ultima accettata
+
+    assert validation.validate_type0(rows) == [rows[0], rows[2]]
+    assert validation.validation_stats["rate"] == 1
+    assert [entry[0] for entry in validation.validation_history[1]] == [1000, 1020]
+
+    quarantined = [json.loads(line) for line in open(validation.quarantine_path)]
+    assert [(entry["tstamp"], entry["reason"]) for entry in quarantined] == [(1010, "rate")]
+
+
+def test_validation_disabled_returns_rows(manager):
+    rows = [(1000, 1, "nan", 200.0, -60)]
+
+    assert manager.validate_type0(rows) is rows
+
+
+def test_invalid_and_out_of_range_readings(validation):
+    rows = [(1000, 2, 20.0, 40.0, -60),
+            (1000, 1, "abc", 40.0, -60),
+            (1060, 2, 20.1, 40.0, -60),
+            (1000, 3, float("inf"), 40.0, -60),
+            (1060, 1, 20.0, 140.0, -60),
+            (1120, 1, 20.0, 40.0, 10)]
+
+    assert validation.validate_type0(rows) == [rows[0], rows[2]]
+    assert validation.validation_stats == {"valid": 2, "nan": 2, "range": 2, "rate": 0, "zscore": 0}
+
+    quarantined = [json.loads(line) for line in open(validation.quarantine_path)]
+    assert [(entry["tstamp"], entry["node_id"], entry["reason"]) for entry in quarantined] == [
+        (1000, 1, "nan"), (1000, 3, "nan"), (1060, 1, "range"), (1120, 1, "range")]
+
+
+def test_unsorted_batch_of_several_nodes(validation):
+    node1 = steady(1, 12)
+    node2 = steady(2, 12, temp=30.0)
+    rows = [row for pair in zip(reversed(node1), node2) for row in pair]
+    rows.insert(7, (1000 + 5 * 60 + 30, 2, 45.0, 40.0, -60))  # picco del nodo 2
+
+    accepted = validation.validate_type0(rows)
+
+    assert accepted == [row for row in rows if row[2] != 45.0]
+    assert validation.validation_stats["zscore"] == 1
+    assert [entry[0] for entry in validation.validation_history[1]] == [row[0] for row in node1]
+    assert [entry[0] for entry in validation.validation_history[2]] == [row[0] for row in node2]
+
+
+def test_zscore_needs_min_history(validation):
+    rows = steady(1, 5) + [(1300, 1, 25.0, 40.0, -60)]
+
+    # poche letture: lo z-score non viene applicato (la variazione e' entro il massimo)
+    assert validation.validate_type0(rows) == rows
+
+    validation.validation_history.clear()
+    rows = steady(1, 10) + [(1600, 1, 25.0, 40.0, -60)]
+    assert validation.validate_type0(rows) == rows[:10]
+    assert validation.validation_stats["zscore"] == 1
+
+
+def test_rate_against_history(validation):
+    validation.validate_type0([(1000, 1, 20.0, 40.0, -60)])
+
+    assert validation.validate_type0([(1010, 1, 22.0, 40.0, -60)]) == []
+    assert validation.validate_type0([(1010, 1, 20.0, 45.0, -60)]) == [(1010, 1, 20.0, 45.0, -60)]
+    assert validation.validation_stats["rate"] == 1
+
+
+def test_validation_summary(validation):
+    validation.validate_type0(steady(1, 3) + [(2000, 1, "nan", 40.0, -60)])
+
+    validation.validation_summary()
+    summary = validation.logfile.getvalue().splitlines()[-1]
+    assert "3 letture valide, 1 scartate (nan 1, range 0, rate 0, zscore 0)" in summary
+
+    # nessuna nuova lettura: nessun riepilogo
+    validation.validation_summary()
+    assert validation.logfile.getvalue().splitlines()[-1] == summary
+
+
+def test_step_change_reseeds_history(validation):
+    for row in steady(1, 30):
+        validation.validate_type0([row])
+
+    # cambiamento reale della temperatura: dopo <reseed> letture scartate diventano la nuova storia
+    step = steady(1, 200, start=1000 + 30 * 60, temp=23.0)
+    accepted = [row for row in step if validation.validate_type0([row])]
+
+    assert accepted == step[5:]
+    assert validation.validation_stats["zscore"] == 5
+    assert validation.validation_outliers[1] == []